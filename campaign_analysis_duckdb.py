@@ -1,13 +1,31 @@
 import streamlit as st
-import streamlit.components.v1
+import streamlit.components.v1 as components
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from streamlit.runtime.uploaded_file_manager import UploadedFile
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import traceback
 import io
+import string
 import duckdb
+import pyarrow as pa
 import tempfile
 import os
 
+# python-calamine reads Excel files far faster than openpyxl; use it when installed
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = None
+
+# Excel uploads above this size are slow to parse, so suggest converting them
+LARGE_EXCEL_BYTES = 50 * 1024 * 1024
+
 # Page configuration
 st.set_page_config(
     page_title="Campaign Analysis - DuckDB Optimized",
@@ -56,32 +74,86 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-@st.cache_data
+def read_uploaded_file(uploaded_file):
+    """Read an uploaded CSV, Parquet or Excel file into a DataFrame"""
+    uploaded_file.seek(0)
+    if uploaded_file.name.endswith('.csv'):
+        try:
+            # Multi-threaded Arrow CSV reader
+            return pd.read_csv(uploaded_file, engine='pyarrow')
+        except (pa.ArrowInvalid, ValueError):
+            # Fall back to the C parser for files the Arrow reader rejects
+            uploaded_file.seek(0)
+            return pd.read_csv(uploaded_file)
+    elif uploaded_file.name.endswith('.parquet'):
+        return pd.read_parquet(uploaded_file)
+    else:
+        return pd.read_excel(uploaded_file, engine=EXCEL_ENGINE)
+
+# Uploads are keyed by their upload id rather than by hashing the file contents, and the
+# preprocessed frame is shared as-is instead of being pickled and copied on every rerun
+@st.cache_resource(
+    show_spinner=False,
+    max_entries=4,
+    hash_funcs={UploadedFile: lambda f: (f.file_id, f.name, f.size)}
+)
 def load_and_convert_data(uploaded_file, file_type="ga"):
-    """Load data and convert to parquet for faster processing"""
+    """Load and preprocess an uploaded file, raising if it can't be read"""
+    df = read_uploaded_file(uploaded_file)
+    
+    # Preprocess based on file type
+    if file_type == "ga":
+        return preprocess_ga_data(df)
+    else:
+        return preprocess_shopify_data(df)
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def to_arrow_table(df):
+    """Convert preprocessed data to an Arrow table once so DuckDB can scan it zero-copy"""
     try:
-        # Load data
-        if uploaded_file.name.endswith('.csv'):
-            df = pd.read_csv(uploaded_file)
-        else:
-            df = pd.read_excel(uploaded_file)
-        
-        # Preprocess based on file type
-        if file_type == "ga":
-            df = preprocess_ga_data(df)
-        else:
-            df = preprocess_shopify_data(df)
-        
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed-type object columns can't be converted; DuckDB can still scan pandas directly
         return df
-    except Exception as e:
-        return None, str(e)
+    
+    # Store date columns as DATE so period filters are plain integer comparisons
+    for col in ['Date', 'Day']:
+        if col in table.column_names:
+            idx = table.column_names.index(col)
+            table = table.set_column(idx, col, table.column(col).cast(pa.date32(), safe=False))
+    
+    return table
 
-def preprocess_ga_data(df):
-    """Preprocess GA data"""
-    df = df.copy()
+def parse_dates(series):
+    """Parse a date column, trying the fast ISO 8601 path before format inference"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    
+    parsed = pd.to_datetime(series, errors='coerce', cache=True, format='ISO8601')
+    # Fall back to inference only if some non-empty values are not ISO dates
+    if (parsed.isna() & series.notna()).any():
+        parsed = pd.to_datetime(series, errors='coerce', cache=True)
+    return parsed
+
+def categorize_columns(df, columns=()):
+    """Store region, source and other repetitive text columns as categories
     
+    Categories are dictionary-encoded in DuckDB and make groupby and unique() work on
+    integer codes. Text columns are converted when at most half their values are distinct.
+    """
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            continue
+        if col in columns or 'region' in col.lower():
+            df[col] = df[col].astype('category')
+        elif pd.api.types.is_string_dtype(df[col]) and df[col].nunique() <= len(df) // 2:
+            df[col] = df[col].astype('category')
+    return df
+
+def preprocess_ga_data(df):
+    """Preprocess GA data (modifies the freshly loaded frame in place)"""
     # Parse date column
-    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+    df['Date'] = parse_dates(df['Date'])
     
     # Remove rows with invalid dates
     df = df.dropna(subset=['Date'])
@@ -91,22 +163,24 @@ def preprocess_ga_data(df):
                       'Add to carts', 'Total purchasers', 'Engaged sessions']
     for col in numeric_columns:
         if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+            # Counters are whole numbers, so store them in the smallest integer type that fits
+            df[col] = pd.to_numeric(pd.to_numeric(df[col], errors='coerce').fillna(0), downcast='unsigned')
     
     # Clean up text columns
     text_columns = ['Session source']
     for col in text_columns:
         if col in df.columns:
-            df[col] = df[col].astype(str).str.strip()
+            # Only non-string columns need converting before stripping
+            if not pd.api.types.is_string_dtype(df[col]):
+                df[col] = df[col].astype(str)
+            df[col] = df[col].str.strip()
     
-    return df
+    return categorize_columns(df, text_columns)
 
 def preprocess_shopify_data(df):
-    """Preprocess Shopify data"""
-    df = df.copy()
-    
+    """Preprocess Shopify data (modifies the freshly loaded frame in place)"""
     # Parse date column
-    df['Day'] = pd.to_datetime(df['Day'], errors='coerce')
+    df['Day'] = parse_dates(df['Day'])
     
     # Remove rows with invalid dates
     df = df.dropna(subset=['Day'])
@@ -114,246 +188,313 @@ def preprocess_shopify_data(df):
     # Ensure numeric columns are numeric
     numeric_columns = ['Net sales', 'Net items sold', 'Orders', 'Average order value', 
                       'Discounts', 'Gross margin', 'Customers', 'New customers']
+    count_columns = ['Net items sold', 'Orders', 'Customers', 'New customers']
     for col in numeric_columns:
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+            # Counts (which can be negative after returns) go in the smallest integer type that
+            # fits; money columns stay float64 so summed totals stay exact to the cent
+            if col in count_columns:
+                df[col] = pd.to_numeric(df[col], downcast='integer')
+    
+    return categorize_columns(df)
+def sorted_unique(series):
+    """List the distinct non-missing values of a column in sorted order"""
+    if isinstance(series.dtype, pd.CategoricalDtype) and series.cat.categories.is_monotonic_increasing:
+        # Categories are already sorted, so just keep the ones that occur (by counting codes)
+        codes = series.cat.codes.to_numpy()
+        present = np.bincount(codes[codes >= 0], minlength=len(series.cat.categories)) > 0
+        return series.cat.categories[present].tolist()
+    return sorted(series.dropna().unique().tolist())
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def ga_summary(ga_data, region_column):
+    """Summarize GA data for the sidebar (session sources, regions and date range)"""
+    regions = sorted_unique(ga_data[region_column]) if region_column in ga_data.columns else []
+    
+    # Shortened list of region names shown above the region pickers
+    if len(regions) <= 10:
+        regions_label = ", ".join(map(str, regions))
+    else:
+        regions_label = f"{', '.join(map(str, regions[:10]))}... and {len(regions)-10} more"
     
-    return df
+    return {
+        'sources': sorted_unique(ga_data['Session source']) if 'Session source' in ga_data.columns else [],
+        'regions': regions,
+        'regions_label': regions_label,
+        'min_date': ga_data['Date'].min().date() if not ga_data.empty else None,
+        'max_date': ga_data['Date'].max().date() if not ga_data.empty else None
+    }
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def memory_usage_mb(df):
+    """Calculate the in-memory size of a DataFrame in MB"""
+    return df.memory_usage(deep=True).sum() / 1024**2
+
+@lru_cache(maxsize=16)
+def default_region_column_index(columns):
+    """Index of the first column whose name mentions 'region' (0 if none), for a tuple of columns"""
+    return next((i for i, col in enumerate(columns) if 'region' in col.lower()), 0)
+
+@lru_cache(maxsize=256)
 def calculate_weeks_in_period(start_date, end_date):
     """Calculate number of weeks in a period, rounded to nearest whole number"""
-    start = pd.to_datetime(start_date)
-    end = pd.to_datetime(end_date)
-    days = (end - start).days + 1
+    days = (end_date - start_date).days + 1
     weeks = days / 7
     # Round to nearest whole number of weeks (minimum 1)
     return max(1, round(weeks))
 
-def calculate_percentage_change(base_value, campaign_value):
-    """Calculate percentage change between base and campaign values"""
-    if base_value == 0:
-        return "N/A" if campaign_value == 0 else "∞"
-    
-    change = ((campaign_value - base_value) / base_value) * 100
-    return f"{change:+.1f}%"
+def calculate_percentage_changes(base_values, campaign_values):
+    """Calculate percentage changes element-wise between arrays of base and campaign values"""
+    base_values = np.asarray(base_values, dtype=np.float64)
+    campaign_values = np.asarray(campaign_values, dtype=np.float64)
+    
+    # Zero bases have no meaningful change, so only the others are divided and formatted
+    changes = np.where(campaign_values == 0, "N/A", "∞").astype(object)
+    valid = base_values != 0
+    base, campaign = base_values[valid], campaign_values[valid]
+    changes[valid] = np.char.mod("%+.1f%%", ((campaign - base) / base) * 100)
+    return changes
 
-def create_analysis_with_duckdb(ga_data, shopify_data, regions, 
-                               base_week1_start, base_week1_end, base_week2_start, base_week2_end,
-                               campaign_start, campaign_end, control_regions, google_sources, 
-                               base_week_method, region_column, shopify_region_column):
-    """Create analysis using DuckDB for faster processing"""
-    
-    # Initialize DuckDB connection
-    conn = duckdb.connect()
+# SQL templates. Only column identifiers (quoted with quote_identifier) are formatted in;
+# there are no values to bind, since the Google source test is precomputed into the
+# is_google column and date windows are applied to the cached results. Sums are cast to
+# DOUBLE because integer SUMs are HUGEINT, which Arrow hands over as Python Decimals.
+GA_CUBE_SQL = """
+SELECT 
+    {region_column} as region,
+    Date,
+    CAST(SUM(Sessions) AS DOUBLE) as sessions,
+    CAST(COALESCE(SUM(Sessions) FILTER (WHERE is_google), 0) AS DOUBLE) as google_sessions
+FROM ga_data 
+GROUP BY 1, 2
+"""
+
+SHOPIFY_CUBE_SQL = """
+SELECT 
+    {region_column} as region,
+    Day,
+    CAST(SUM("Net sales") AS DOUBLE) as net_sales
+FROM shopify_data 
+GROUP BY 1, 2
+"""
+
+def quote_identifier(name):
+    """Quote a column name for use as a SQL identifier, escaping embedded quotes"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+# Inputs up to this many rows aggregate faster with a pandas groupby than through
+# Arrow conversion, view registration and a DuckDB query
+PANDAS_AGGREGATION_MAX_ROWS = 1_000_000
+
+def available_cpu_count():
+    """Number of CPUs this process may actually run on (respecting affinity/container limits)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+@st.cache_resource(show_spinner=False)
+def get_duckdb_database():
+    """Open the in-memory DuckDB database shared by all sessions of the app"""
+    # Size the thread pool to the CPUs we can use, and let large aggregations spill to
+    # the system temp directory instead of failing when memory runs short
+    return duckdb.connect(config={
+        'threads': available_cpu_count(),
+        'temp_directory': os.path.join(tempfile.gettempdir(), 'duckdb')
+    })
+
+def get_duckdb_cursor():
+    """Open a cursor on the shared DuckDB database for a single query"""
+    # Registered views are local to a cursor, so concurrent queries never see each other's data
+    return get_duckdb_database().cursor()
+
+def google_source_flags(ga_data, google_sources):
+    """Flag the GA rows whose session source is one of the selected Google sources"""
+    if 'Session source' not in ga_data.columns:
+        return np.zeros(len(ga_data), dtype=bool)
+    
+    sources = ga_data['Session source']
+    if isinstance(sources.dtype, pd.CategoricalDtype):
+        # Test each category once and look the result up by code (code -1 is a missing source)
+        category_flags = np.append(sources.cat.categories.isin(google_sources), False)
+        return category_flags[sources.cat.codes.to_numpy()]
+    return sources.isin(google_sources).to_numpy()
+
+# A daily cube maps 'region_codes' (-1 for a missing region) into the 'regions' labels,
+# and holds one NumPy array per date and value column, with one entry per region and day
+
+def groupby_to_cube(grouped, date_column):
+    """Convert a (region, date)-indexed groupby result to the column arrays of a daily cube"""
+    cube = {
+        'region_codes': grouped.index.codes[0],
+        'regions': grouped.index.levels[0].to_numpy(dtype=object),
+        date_column: grouped.index.get_level_values(1).to_numpy()
+    }
+    for col in grouped.columns:
+        cube[col] = grouped[col].to_numpy()
+    return cube
+
+def arrow_to_cube(table, date_column):
+    """Convert a DuckDB (region, date, values...) Arrow result to the column arrays of a daily cube"""
+    # Dictionary-encode regions in Arrow so no Python string is created per row
+    regions = table.column('region').combine_chunks().dictionary_encode()
+    cube = {
+        'region_codes': regions.indices.fill_null(-1).to_numpy(),
+        'regions': regions.dictionary.to_numpy(zero_copy_only=False),
+        date_column: table.column(date_column).to_numpy()
+    }
+    for col in table.column_names[2:]:
+        cube[col] = table.column(col).to_numpy()
+    return cube
+
+def build_ga_cube(ga_data, region_column, google_sources):
+    """Pre-aggregate GA sessions to a daily cube with one row per region and day"""
+    is_google = google_source_flags(ga_data, google_sources)
+    if len(ga_data) <= PANDAS_AGGREGATION_MAX_ROWS and region_column not in ('Date', 'Sessions'):
+        # Group on the calendar day, as DuckDB does after the DATE cast in to_arrow_table
+        daily = ga_data[[region_column]].assign(
+            Date=ga_data['Date'].dt.normalize(),
+            sessions=ga_data['Sessions'],
+            google_sessions=np.where(is_google, ga_data['Sessions'], 0)
+        ).groupby([region_column, 'Date'], observed=True, sort=False).sum()
+        return groupby_to_cube(daily, 'Date')
+    
+    ga_table = to_arrow_table(ga_data)
+    if isinstance(ga_table, pa.Table):
+        ga_table = ga_table.append_column('is_google', pa.array(is_google))
+    else:
+        ga_table = ga_table.assign(is_google=is_google)
     
+    conn = get_duckdb_cursor()
     try:
-        # Register dataframes with DuckDB
-        conn.register('ga_data', ga_data)
-        conn.register('shopify_data', shopify_data)
-        
-        # Calculate weeks for averaging (always rounded to nearest whole number)
-        base_week1_weeks = calculate_weeks_in_period(base_week1_start, base_week1_end)
-        base_week2_weeks = calculate_weeks_in_period(base_week2_start, base_week2_end)
-        campaign_weeks = calculate_weeks_in_period(campaign_start, campaign_end)
-        
-        # Base weeks are ALWAYS averaged (divided by number of weeks)
-        # Campaign can be averaged or summed based on user preference
-        base1_divisor = base_week1_weeks  # Always divide base week 1 by its weeks
-        base2_divisor = base_week2_weeks  # Always divide base week 2 by its weeks
-        campaign_divisor = campaign_weeks if base_week_method == "Average (÷weeks)" else 1
-        
-        # Create Google sources filter
-        google_sources_str = "', '".join(google_sources)
-        google_filter = f'"Session source" IN (\'{google_sources_str}\')' if google_sources else "1=0"
-        
-        results = []
-        
-        # Process target regions
-        target_regions = [r for r in regions if r not in control_regions]
-        
-        for region in target_regions:
-            # GA Base Week 1 query
-            ga_base1_query = f"""
-            SELECT 
-                SUM(Sessions) as total_sessions,
-                SUM(CASE WHEN {google_filter} THEN Sessions ELSE 0 END) as google_sessions
-            FROM ga_data 
-            WHERE "{region_column}" = '{region}' 
-            AND Date >= '{base_week1_start}' 
-            AND Date <= '{base_week1_end}'
-            """
-            
-            # GA Base Week 2 query
-            ga_base2_query = f"""
-            SELECT 
-                SUM(Sessions) as total_sessions,
-                SUM(CASE WHEN {google_filter} THEN Sessions ELSE 0 END) as google_sessions
-            FROM ga_data 
-            WHERE "{region_column}" = '{region}' 
-            AND Date >= '{base_week2_start}' 
-            AND Date <= '{base_week2_end}'
-            """
-            
-            # GA Campaign query
-            ga_campaign_query = f"""
-            SELECT 
-                SUM(Sessions) as total_sessions,
-                SUM(CASE WHEN {google_filter} THEN Sessions ELSE 0 END) as google_sessions
-            FROM ga_data 
-            WHERE "{region_column}" = '{region}' 
-            AND Date >= '{campaign_start}' 
-            AND Date <= '{campaign_end}'
-            """
-            
-            # Shopify queries
-            shopify_base1_query = f"""
-            SELECT SUM("Net sales") as net_sales
-            FROM shopify_data 
-            WHERE "{shopify_region_column}" = '{region}' 
-            AND Day >= '{base_week1_start}' 
-            AND Day <= '{base_week1_end}'
-            """
-            
-            shopify_base2_query = f"""
-            SELECT SUM("Net sales") as net_sales
-            FROM shopify_data 
-            WHERE "{shopify_region_column}" = '{region}' 
-            AND Day >= '{base_week2_start}' 
-            AND Day <= '{base_week2_end}'
-            """
-            
-            shopify_campaign_query = f"""
-            SELECT SUM("Net sales") as net_sales
-            FROM shopify_data 
-            WHERE "{shopify_region_column}" = '{region}' 
-            AND Day >= '{campaign_start}' 
-            AND Day <= '{campaign_end}'
-            """
-            
-            # Execute queries
-            ga_base1_result = conn.execute(ga_base1_query).fetchone()
-            ga_base2_result = conn.execute(ga_base2_query).fetchone()
-            ga_campaign_result = conn.execute(ga_campaign_query).fetchone()
-            
-            shopify_base1_result = conn.execute(shopify_base1_query).fetchone()
-            shopify_base2_result = conn.execute(shopify_base2_query).fetchone()
-            shopify_campaign_result = conn.execute(shopify_campaign_query).fetchone()
-            
-            # Calculate metrics with proper divisors (base weeks always averaged)
-            sessions_total_base1 = (ga_base1_result[0] or 0) / base1_divisor
-            sessions_total_base2 = (ga_base2_result[0] or 0) / base2_divisor
-            sessions_total_campaign = (ga_campaign_result[0] or 0) / campaign_divisor
-            
-            sessions_google_base1 = (ga_base1_result[1] or 0) / base1_divisor
-            sessions_google_base2 = (ga_base2_result[1] or 0) / base2_divisor
-            sessions_google_campaign = (ga_campaign_result[1] or 0) / campaign_divisor
-            
-            net_sales_base1 = (shopify_base1_result[0] or 0) / base1_divisor
-            net_sales_base2 = (shopify_base2_result[0] or 0) / base2_divisor
-            net_sales_campaign = (shopify_campaign_result[0] or 0) / campaign_divisor
-            
-            # Calculate percentage changes
-            sessions_total_change1 = calculate_percentage_change(sessions_total_base1, sessions_total_campaign)
-            sessions_total_change2 = calculate_percentage_change(sessions_total_base2, sessions_total_campaign)
-            sessions_google_change1 = calculate_percentage_change(sessions_google_base1, sessions_google_campaign)
-            sessions_google_change2 = calculate_percentage_change(sessions_google_base2, sessions_google_campaign)
-            net_sales_change1 = calculate_percentage_change(net_sales_base1, net_sales_campaign)
-            net_sales_change2 = calculate_percentage_change(net_sales_base2, net_sales_campaign)
-            
-            results.append({
-                'Region': region,
-                'Sessions_Total_Base1': sessions_total_base1,
-                'Sessions_Total_Base2': sessions_total_base2,
-                'Sessions_Total_Campaign': sessions_total_campaign,
-                'Sessions_Total_Change1': sessions_total_change1,
-                'Sessions_Total_Change2': sessions_total_change2,
-                'Sessions_Google_Base1': sessions_google_base1,
-                'Sessions_Google_Base2': sessions_google_base2,
-                'Sessions_Google_Campaign': sessions_google_campaign,
-                'Sessions_Google_Change1': sessions_google_change1,
-                'Sessions_Google_Change2': sessions_google_change2,
-                'Net_Sales_Base1': net_sales_base1,
-                'Net_Sales_Base2': net_sales_base2,
-                'Net_Sales_Campaign': net_sales_campaign,
-                'Net_Sales_Change1': net_sales_change1,
-                'Net_Sales_Change2': net_sales_change2
-            })
-        
-        return results, base1_divisor, base2_divisor, campaign_divisor, conn
-        
-    except Exception as e:
+        conn.register('ga_data', ga_table)
+        return arrow_to_cube(
+            conn.execute(GA_CUBE_SQL.format(region_column=quote_identifier(region_column))).to_arrow_table(),
+            'Date'
+        )
+    finally:
         conn.close()
-        raise e
-def process_control_regions_duckdb(conn, control_regions, google_sources, 
-                                  base_week1_start, base_week1_end, base_week2_start, base_week2_end,
-                                  campaign_start, campaign_end, region_column, shopify_region_column,
-                                  base1_divisor, base2_divisor, campaign_divisor):
-    """Process control regions using DuckDB aggregation"""
-    
-    if not control_regions:
-        return None
+
+def build_shopify_cube(shopify_data, region_column):
+    """Pre-aggregate Shopify net sales to a daily cube with one row per region and day"""
+    if len(shopify_data) <= PANDAS_AGGREGATION_MAX_ROWS and region_column not in ('Day', 'Net sales'):
+        daily = shopify_data[[region_column]].assign(
+            Day=shopify_data['Day'].dt.normalize(),
+            net_sales=shopify_data['Net sales']
+        ).groupby([region_column, 'Day'], observed=True, sort=False).sum()
+        return groupby_to_cube(daily, 'Day')
+    
+    conn = get_duckdb_cursor()
+    try:
+        conn.register('shopify_data', to_arrow_table(shopify_data))
+        return arrow_to_cube(
+            conn.execute(SHOPIFY_CUBE_SQL.format(region_column=quote_identifier(region_column))).to_arrow_table(),
+            'Day'
+        )
+    finally:
+        conn.close()
+
+def build_prefix_sums(cube, date_column, value_columns):
+    """Build per-region cumulative sums over a dense daily range from a daily cube
     
-    # Create control regions filter
-    control_regions_str = "', '".join(control_regions)
-    control_filter = f'"{region_column}" IN (\'{control_regions_str}\')'
-    shopify_control_filter = f'"{shopify_region_column}" IN (\'{control_regions_str}\')'
-    
-    # Create Google sources filter
-    google_sources_str = "', '".join(google_sources)
-    google_filter = f'"Session source" IN (\'{google_sources_str}\')' if google_sources else "1=0"
-    
-    # Aggregate GA data for control regions
-    ga_control_query = f"""
-    SELECT 
-        SUM(CASE WHEN Date >= '{base_week1_start}' AND Date <= '{base_week1_end}' THEN Sessions ELSE 0 END) as sessions_base1,
-        SUM(CASE WHEN Date >= '{base_week2_start}' AND Date <= '{base_week2_end}' THEN Sessions ELSE 0 END) as sessions_base2,
-        SUM(CASE WHEN Date >= '{campaign_start}' AND Date <= '{campaign_end}' THEN Sessions ELSE 0 END) as sessions_campaign,
-        SUM(CASE WHEN Date >= '{base_week1_start}' AND Date <= '{base_week1_end}' AND {google_filter} THEN Sessions ELSE 0 END) as google_sessions_base1,
-        SUM(CASE WHEN Date >= '{base_week2_start}' AND Date <= '{base_week2_end}' AND {google_filter} THEN Sessions ELSE 0 END) as google_sessions_base2,
-        SUM(CASE WHEN Date >= '{campaign_start}' AND Date <= '{campaign_end}' AND {google_filter} THEN Sessions ELSE 0 END) as google_sessions_campaign
-    FROM ga_data 
-    WHERE {control_filter}
+    Column j of each matrix holds the running total up to (but excluding) day j, so the
+    sum over any window of days [s, e] is cum[:, e + 1] - cum[:, s].
     """
+    # Rows with a missing region can never be selected, so leave them out
+    keep = cube['region_codes'] >= 0
+    region_codes = cube['region_codes'][keep]
+    regions = cube['regions']
+    days = cube[date_column][keep].astype('datetime64[D]')
+    first_day = days.min() if len(days) else np.datetime64('1970-01-01', 'D')
+    day_offsets = (days - first_day).astype(np.int64)
+    num_days = int(day_offsets.max()) + 1 if len(days) else 0
+    
+    cum = {}
+    for col in value_columns:
+        daily = np.zeros((len(regions), num_days), dtype=np.float64)
+        # Accumulate, since several cube rows can fall on the same region and day
+        np.add.at(daily, (region_codes, day_offsets), cube[col][keep])
+        cum[col] = np.zeros((len(regions), num_days + 1), dtype=np.float64)
+        np.cumsum(daily, axis=1, out=cum[col][:, 1:])
+    
+    return {'regions': pd.Index(regions), 'first_day': first_day, 'cum': cum}
+
+# The prefix sums are only ever read, so they are cached as shared resources; cache_data
+# would unpickle a copy of every region x day matrix on each rerun
+@st.cache_resource(show_spinner=False, max_entries=8)
+def build_ga_prefix_sums(ga_data, region_column, google_sources):
+    """Build per-region daily prefix sums of total and Google sessions"""
+    return build_prefix_sums(
+        build_ga_cube(ga_data, region_column, google_sources),
+        'Date', ('sessions', 'google_sessions')
+    )
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def build_shopify_prefix_sums(shopify_data, region_column):
+    """Build per-region daily prefix sums of net sales"""
+    return build_prefix_sums(build_shopify_cube(shopify_data, region_column), 'Day', ('net_sales',))
+
+def period_sums(prefix_sums, regions, periods):
+    """Sum every prefix-sum column over each named period for the given regions
     
-    # Aggregate Shopify data for control regions
-    shopify_control_query = f"""
-    SELECT 
-        SUM(CASE WHEN Day >= '{base_week1_start}' AND Day <= '{base_week1_end}' THEN "Net sales" ELSE 0 END) as sales_base1,
-        SUM(CASE WHEN Day >= '{base_week2_start}' AND Day <= '{base_week2_end}' THEN "Net sales" ELSE 0 END) as sales_base2,
-        SUM(CASE WHEN Day >= '{campaign_start}' AND Day <= '{campaign_end}' THEN "Net sales" ELSE 0 END) as sales_campaign
-    FROM shopify_data 
-    WHERE {shopify_control_filter}
+    Returns one row per region and one column per value column and period, e.g.
+    'sessions_base1'. Regions without any rows in the data sum to zero.
     """
+    first_day = prefix_sums['first_day']
+    num_days = next(iter(prefix_sums['cum'].values())).shape[1] - 1
+    
+    # Clip each window to the covered date range; days outside it contribute nothing
+    starts = np.array([(np.datetime64(start, 'D') - first_day).astype(np.int64) for start, _ in periods.values()])
+    ends = np.array([(np.datetime64(end, 'D') - first_day).astype(np.int64) + 1 for _, end in periods.values()])
+    starts = np.clip(starts, 0, num_days)
+    ends = np.maximum(np.clip(ends, 0, num_days), starts)
+    
+    rows = prefix_sums['regions'].get_indexer(regions)
+    found = rows >= 0
+    
+    totals = {}
+    for col, cum in prefix_sums['cum'].items():
+        sums = np.zeros((len(regions), len(periods)), dtype=np.float64)
+        sums[found] = cum[np.ix_(rows[found], ends)] - cum[np.ix_(rows[found], starts)]
+        for j, period in enumerate(periods):
+            totals[f'{col}_{period}'] = sums[:, j]
+    return pd.DataFrame(totals)
+
+def run_in_script_context(ctx, func, *args):
+    """Run func in a worker thread attached to the calling script's Streamlit context"""
+    add_script_run_ctx(threading.current_thread(), ctx)
+    return func(*args)
+
+def build_analysis_results(labels, ga_totals, shopify_totals, base1_divisor, base2_divisor, campaign_divisor):
+    """Build result rows (metrics and percentage changes) from per-period totals, one row per label"""
+    # Calculate metrics with proper divisors (base weeks always averaged), one array per column
+    sessions_total_base1 = ga_totals['sessions_base1'].to_numpy() / base1_divisor
+    sessions_total_base2 = ga_totals['sessions_base2'].to_numpy() / base2_divisor
+    sessions_total_campaign = ga_totals['sessions_campaign'].to_numpy() / campaign_divisor
+    
+    sessions_google_base1 = ga_totals['google_sessions_base1'].to_numpy() / base1_divisor
+    sessions_google_base2 = ga_totals['google_sessions_base2'].to_numpy() / base2_divisor
+    sessions_google_campaign = ga_totals['google_sessions_campaign'].to_numpy() / campaign_divisor
+    
+    net_sales_base1 = shopify_totals['net_sales_base1'].to_numpy() / base1_divisor
+    net_sales_base2 = shopify_totals['net_sales_base2'].to_numpy() / base2_divisor
+    net_sales_campaign = shopify_totals['net_sales_campaign'].to_numpy() / campaign_divisor
+    
+    # Calculate all six percentage change columns for all regions in one batched call
+    (sessions_total_change1, sessions_total_change2,
+     sessions_google_change1, sessions_google_change2,
+     net_sales_change1, net_sales_change2) = calculate_percentage_changes(
+        [sessions_total_base1, sessions_total_base2,
+         sessions_google_base1, sessions_google_base2,
+         net_sales_base1, net_sales_base2],
+        [sessions_total_campaign, sessions_total_campaign,
+         sessions_google_campaign, sessions_google_campaign,
+         net_sales_campaign, net_sales_campaign]
+    )
     
-    # Execute queries
-    ga_control_result = conn.execute(ga_control_query).fetchone()
-    shopify_control_result = conn.execute(shopify_control_query).fetchone()
-    
-    # Calculate control region count and apply divisors
-    control_region_count = len(control_regions)
-    
-    # Apply control region and week divisors (base weeks always averaged)
-    sessions_total_base1 = (ga_control_result[0] or 0) / (control_region_count * base1_divisor)
-    sessions_total_base2 = (ga_control_result[1] or 0) / (control_region_count * base2_divisor)
-    sessions_total_campaign = (ga_control_result[2] or 0) / (control_region_count * campaign_divisor)
-    
-    sessions_google_base1 = (ga_control_result[3] or 0) / (control_region_count * base1_divisor)
-    sessions_google_base2 = (ga_control_result[4] or 0) / (control_region_count * base2_divisor)
-    sessions_google_campaign = (ga_control_result[5] or 0) / (control_region_count * campaign_divisor)
-    
-    net_sales_base1 = (shopify_control_result[0] or 0) / (control_region_count * base1_divisor)
-    net_sales_base2 = (shopify_control_result[1] or 0) / (control_region_count * base2_divisor)
-    net_sales_campaign = (shopify_control_result[2] or 0) / (control_region_count * campaign_divisor)
-    
-    # Calculate percentage changes
-    sessions_total_change1 = calculate_percentage_change(sessions_total_base1, sessions_total_campaign)
-    sessions_total_change2 = calculate_percentage_change(sessions_total_base2, sessions_total_campaign)
-    sessions_google_change1 = calculate_percentage_change(sessions_google_base1, sessions_google_campaign)
-    sessions_google_change2 = calculate_percentage_change(sessions_google_base2, sessions_google_campaign)
-    net_sales_change1 = calculate_percentage_change(net_sales_base1, net_sales_campaign)
-    net_sales_change2 = calculate_percentage_change(net_sales_base2, net_sales_campaign)
-    
-    return {
-        'Region': 'Control set',
+    # Assemble the typed result columns directly; the arrays are used as-is without copying
+    return pd.DataFrame({
+        'Region': np.array(labels, dtype=object),
         'Sessions_Total_Base1': sessions_total_base1,
         'Sessions_Total_Base2': sessions_total_base2,
         'Sessions_Total_Campaign': sessions_total_campaign,
@@ -369,38 +510,166 @@ def process_control_regions_duckdb(conn, control_regions, google_sources,
         'Net_Sales_Campaign': net_sales_campaign,
         'Net_Sales_Change1': net_sales_change1,
         'Net_Sales_Change2': net_sales_change2
+    }, copy=False)
+
+def create_analysis_with_duckdb(ga_data, shopify_data, regions, 
+                               base_week1_start, base_week1_end, base_week2_start, base_week2_end,
+                               campaign_start, campaign_end, control_regions, google_sources, 
+                               base_week_method, region_column, shopify_region_column):
+    """Create analysis from DuckDB-built daily cubes using prefix sums for each period"""
+    
+    # Cumulative sums of the daily per-region cubes (aggregated by DuckDB) are cached, so
+    # changing only the dates re-uses them and every period total is a constant-time lookup
+    # The GA and Shopify builds are independent, so run them concurrently on their own cursors
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        ga_future = executor.submit(
+            run_in_script_context, ctx, build_ga_prefix_sums,
+            ga_data, region_column, tuple(sorted(google_sources))
+        )
+        shopify_future = executor.submit(
+            run_in_script_context, ctx, build_shopify_prefix_sums,
+            shopify_data, shopify_region_column
+        )
+        ga_prefix = ga_future.result()
+        shopify_prefix = shopify_future.result()
+    prefix_sums = (ga_prefix, shopify_prefix)
+    
+    # Calculate weeks for averaging (always rounded to nearest whole number)
+    base_week1_weeks = calculate_weeks_in_period(base_week1_start, base_week1_end)
+    base_week2_weeks = calculate_weeks_in_period(base_week2_start, base_week2_end)
+    campaign_weeks = calculate_weeks_in_period(campaign_start, campaign_end)
+    
+    # Base weeks are ALWAYS averaged (divided by number of weeks)
+    # Campaign can be averaged or summed based on user preference
+    base1_divisor = base_week1_weeks  # Always divide base week 1 by its weeks
+    base2_divisor = base_week2_weeks  # Always divide base week 2 by its weeks
+    campaign_divisor = campaign_weeks if base_week_method == "Average (÷weeks)" else 1
+    
+    # Process target regions
+    target_regions = [r for r in regions if r not in control_regions]
+    
+    # Period totals for all target regions and all three periods at once
+    periods = {
+        'base1': (base_week1_start, base_week1_end),
+        'base2': (base_week2_start, base_week2_end),
+        'campaign': (campaign_start, campaign_end)
     }
+    ga_totals = period_sums(ga_prefix, target_regions, periods)
+    shopify_totals = period_sums(shopify_prefix, target_regions, periods)
+    
+    results = build_analysis_results(
+        target_regions, ga_totals, shopify_totals, base1_divisor, base2_divisor, campaign_divisor
+    )
+    
+    return results, base1_divisor, base2_divisor, campaign_divisor, prefix_sums
 
-def format_analysis_table_html(df, base1_label, base2_label, campaign_label):
-    """Format the analysis table as HTML with same format as original"""
+def process_control_regions_duckdb(prefix_sums, control_regions, 
+                                  base_week1_start, base_week1_end, base_week2_start, base_week2_end,
+                                  campaign_start, campaign_end,
+                                  base1_divisor, base2_divisor, campaign_divisor):
+    """Process control regions by totalling their prefix-sum windows"""
     
-    html = f"""
+    if not control_regions:
+        return None
+    
+    ga_prefix, shopify_prefix = prefix_sums
+    
+    # Aggregate GA and Shopify data for control regions
+    periods = {
+        'base1': (base_week1_start, base_week1_end),
+        'base2': (base_week2_start, base_week2_end),
+        'campaign': (campaign_start, campaign_end)
+    }
+    
+    # Average the control regions' totals into a single row and derive it the same way as
+    # the target regions
+    control_region_count = len(control_regions)
+    ga_totals = period_sums(ga_prefix, control_regions, periods).sum().to_frame().T / control_region_count
+    shopify_totals = period_sums(shopify_prefix, control_regions, periods).sum().to_frame().T / control_region_count
+    
+    return build_analysis_results(
+        ['Control set'], ga_totals, shopify_totals, base1_divisor, base2_divisor, campaign_divisor
+    )
+
+TABLE_ROW_HTML = """
+            <tr class="{row_class}">
+                <td>{region}</td>
+                <td class="sessions-total">{sessions_total_base}</td>
+                <td class="sessions-total">{sessions_total_campaign}</td>
+                <td class="sessions-total">{sessions_total_change}</td>
+                <td class="sessions-google">{sessions_google_base}</td>
+                <td class="sessions-google">{sessions_google_campaign}</td>
+                <td class="sessions-google">{sessions_google_change}</td>
+                <td class="net-sales">{net_sales_base}</td>
+                <td class="net-sales">{net_sales_campaign}</td>
+                <td class="net-sales">{net_sales_change}</td>
+            </tr>
+        """
+
+def format_report_cells(df):
+    """Format every column of an analysis frame for display, keeping the column names"""
+    
+    # Format whole columns at once, and each column only once for both comparison tables
+    cells = {'Region': df['Region'].astype(str)}
+    for col in df.columns[1:]:
+        if 'Change' in col:
+            cells[col] = df[col]
+        elif col.startswith('Net_Sales'):
+            cells[col] = df[col].map('${:,.0f}'.format)
+        else:
+            cells[col] = df[col].map('{:,.0f}'.format)
+    return pd.DataFrame(cells)
+
+def format_comparison_cells(cells, base):
+    """Select the formatted cells comparing base week `base` ('1' or '2') against the campaign"""
+    return pd.DataFrame({
+        'region': cells['Region'],
+        'sessions_total_base': cells[f'Sessions_Total_Base{base}'],
+        'sessions_total_campaign': cells['Sessions_Total_Campaign'],
+        'sessions_total_change': cells[f'Sessions_Total_Change{base}'],
+        'sessions_google_base': cells[f'Sessions_Google_Base{base}'],
+        'sessions_google_campaign': cells['Sessions_Google_Campaign'],
+        'sessions_google_change': cells[f'Sessions_Google_Change{base}'],
+        'net_sales_base': cells[f'Net_Sales_Base{base}'],
+        'net_sales_campaign': cells['Net_Sales_Campaign'],
+        'net_sales_change': cells[f'Net_Sales_Change{base}']
+    })
+
+def format_table_rows_html(cells, base):
+    """Format the body rows comparing base week `base` ('1' or '2') against the campaign"""
+    rows = format_comparison_cells(cells, base)
+    rows['row_class'] = np.where(cells['Region'] == 'Control set', "control-row", "region-row")
+    
+    return "".join(TABLE_ROW_HTML.format(**row) for row in rows.to_dict('records'))
+
+ANALYSIS_TABLE_HTML = string.Template("""
     <!DOCTYPE html>
     <html>
     <head>
         <style>
-            .analysis-table {{
+            .analysis-table {
                 border-collapse: collapse;
                 width: 100%;
                 margin: 20px 0;
                 font-size: 12px;
                 font-family: Arial, sans-serif;
-            }}
-            .analysis-table th, .analysis-table td {{
+            }
+            .analysis-table th, .analysis-table td {
                 border: 1px solid #333;
                 padding: 8px;
                 text-align: center;
                 vertical-align: middle;
-            }}
-            .analysis-table th {{
+            }
+            .analysis-table th {
                 background-color: #f2f2f2;
                 font-weight: bold;
-            }}
-            .sessions-total {{ background-color: #e6f3ff; }}
-            .sessions-google {{ background-color: #fff2cc; }}
-            .net-sales {{ background-color: #e8f5e8; }}
-            .region-row {{ background-color: #f0f0f0; font-weight: bold; }}
-            .control-row {{ background-color: #f8f8f8; }}
+            }
+            .sessions-total { background-color: #e6f3ff; }
+            .sessions-google { background-color: #fff2cc; }
+            .net-sales { background-color: #e8f5e8; }
+            .region-row { background-color: #f0f0f0; font-weight: bold; }
+            .control-row { background-color: #f8f8f8; }
         </style>
     </head>
     <body>
@@ -415,40 +684,19 @@ def format_analysis_table_html(df, base1_label, base2_label, campaign_label):
                 <th colspan="3" class="net-sales">Net Sales (Total)</th>
             </tr>
             <tr>
-                <th class="sessions-total">{base1_label}</th>
-                <th class="sessions-total">{campaign_label}</th>
+                <th class="sessions-total">${base1_label}</th>
+                <th class="sessions-total">${campaign_label}</th>
                 <th class="sessions-total">%change</th>
-                <th class="sessions-google">{base1_label}</th>
-                <th class="sessions-google">{campaign_label}</th>
+                <th class="sessions-google">${base1_label}</th>
+                <th class="sessions-google">${campaign_label}</th>
                 <th class="sessions-google">%change</th>
-                <th class="net-sales">{base1_label}</th>
-                <th class="net-sales">{campaign_label}</th>
+                <th class="net-sales">${base1_label}</th>
+                <th class="net-sales">${campaign_label}</th>
                 <th class="net-sales">%change</th>
             </tr>
         </thead>
         <tbody>
-    """
-    
-    # Add rows for Base Week 1 vs Campaign comparison
-    for _, row in df.iterrows():
-        row_class = "region-row" if row['Region'] not in ['Control set'] else "control-row"
-        html += f"""
-            <tr class="{row_class}">
-                <td>{row['Region']}</td>
-                <td class="sessions-total">{row['Sessions_Total_Base1']:,.0f}</td>
-                <td class="sessions-total">{row['Sessions_Total_Campaign']:,.0f}</td>
-                <td class="sessions-total">{row['Sessions_Total_Change1']}</td>
-                <td class="sessions-google">{row['Sessions_Google_Base1']:,.0f}</td>
-                <td class="sessions-google">{row['Sessions_Google_Campaign']:,.0f}</td>
-                <td class="sessions-google">{row['Sessions_Google_Change1']}</td>
-                <td class="net-sales">${row['Net_Sales_Base1']:,.0f}</td>
-                <td class="net-sales">${row['Net_Sales_Campaign']:,.0f}</td>
-                <td class="net-sales">{row['Net_Sales_Change1']}</td>
-            </tr>
-        """
-    
-    # Add separator and second comparison table
-    html += f"""
+    ${body1}
         </tbody>
     </table>
     
@@ -464,49 +712,52 @@ def format_analysis_table_html(df, base1_label, base2_label, campaign_label):
                 <th colspan="3" class="net-sales">Net Sales (Total)</th>
             </tr>
             <tr>
-                <th class="sessions-total">{base2_label}</th>
-                <th class="sessions-total">{campaign_label}</th>
+                <th class="sessions-total">${base2_label}</th>
+                <th class="sessions-total">${campaign_label}</th>
                 <th class="sessions-total">%change</th>
-                <th class="sessions-google">{base2_label}</th>
-                <th class="sessions-google">{campaign_label}</th>
+                <th class="sessions-google">${base2_label}</th>
+                <th class="sessions-google">${campaign_label}</th>
                 <th class="sessions-google">%change</th>
-                <th class="net-sales">{base2_label}</th>
-                <th class="net-sales">{campaign_label}</th>
+                <th class="net-sales">${base2_label}</th>
+                <th class="net-sales">${campaign_label}</th>
                 <th class="net-sales">%change</th>
             </tr>
         </thead>
         <tbody>
-    """
-    
-    # Add rows for Base Week 2 vs Campaign comparison
-    for _, row in df.iterrows():
-        row_class = "region-row" if row['Region'] not in ['Control set'] else "control-row"
-        html += f"""
-            <tr class="{row_class}">
-                <td>{row['Region']}</td>
-                <td class="sessions-total">{row['Sessions_Total_Base2']:,.0f}</td>
-                <td class="sessions-total">{row['Sessions_Total_Campaign']:,.0f}</td>
-                <td class="sessions-total">{row['Sessions_Total_Change2']}</td>
-                <td class="sessions-google">{row['Sessions_Google_Base2']:,.0f}</td>
-                <td class="sessions-google">{row['Sessions_Google_Campaign']:,.0f}</td>
-                <td class="sessions-google">{row['Sessions_Google_Change2']}</td>
-                <td class="net-sales">${row['Net_Sales_Base2']:,.0f}</td>
-                <td class="net-sales">${row['Net_Sales_Campaign']:,.0f}</td>
-                <td class="net-sales">{row['Net_Sales_Change2']}</td>
-            </tr>
-        """
-    
-    html += """
+    ${body2}
         </tbody>
     </table>
     </body>
     </html>
-    """
-    
-    return html
+    """)
 
+def format_analysis_table_html(df, base1_label, base2_label, campaign_label):
+    """Format the analysis table as HTML with same format as original"""
+    cells = format_report_cells(df)
+    return ANALYSIS_TABLE_HTML.substitute(
+        base1_label=base1_label,
+        base2_label=base2_label,
+        campaign_label=campaign_label,
+        body1=format_table_rows_html(cells, '1'),
+        body2=format_table_rows_html(cells, '2')
+    )
+
+def average_percentage_change(changes):
+    """Average a column of formatted percentage changes, skipping 'N/A' and '∞' (None if none are numeric)"""
+    # Parse the whole column at once; anything that isn't a number becomes NaN
+    values = pd.to_numeric(changes.astype(str).str.rstrip('%'), errors='coerce')
+    values = values[np.isfinite(values)]
+    return values.mean() if len(values) else None
+
+# Largest number of regions offered at once in the region multiselects
+MAX_REGION_OPTIONS = 1000
+
+# Number of regions shown per page of a report's table
+REPORT_PAGE_SIZE = 50
+
+@st.fragment
 def display_report(report):
-    """Display a stored analysis report with download option"""
+    """Display a stored analysis report with download option (reruns on its own when its widgets change)"""
     
     # Extract report data
     report_id = report['id']
@@ -537,164 +788,120 @@ def display_report(report):
             st.write(f"• Google Sources: {len(config['google_sources'])} selected")
             st.write(f"• Method: {config['base_week_method']}")
         
-        # Generate and display HTML table
-        html_table = format_analysis_table_html(analysis_df, base1_label, base2_label, campaign_label)
-        st.components.v1.html(html_table, height=600, scrolling=True)
+        # Large reports are shown a page of regions at a time so only those rows are rendered
+        num_pages = -(-len(analysis_df) // REPORT_PAGE_SIZE)
+        page = 1
+        if num_pages > 1:
+            page = st.number_input(
+                f"Table page (of {num_pages})", min_value=1, max_value=num_pages, value=1,
+                key=f"report_page_{report_id}"
+            )
         
-        # Create CSV data for download (matching exact display format)
-        csv_data = create_csv_export_data(analysis_df, base1_label, base2_label, campaign_label)
+        # A stored report never changes, so each page's HTML is generated once and kept with it
+        html_pages = report.setdefault('html_pages', {})
+        if page not in html_pages:
+            table_df = analysis_df.iloc[(page - 1) * REPORT_PAGE_SIZE:page * REPORT_PAGE_SIZE]
+            html_pages[page] = format_analysis_table_html(table_df, base1_label, base2_label, campaign_label)
+        components.html(html_pages[page], height=600, scrolling=True)
         
-        # Download button for this specific report
+        # Download button for this specific report; the CSV (matching exact display format)
+        # is only built when the button is clicked, and clicking doesn't rerun the app
         st.download_button(
             label=f"📥 Download Report #{report_id} as CSV",
-            data=csv_data,
+            data=lambda: create_csv_export_bytes(analysis_df, base1_label, base2_label, campaign_label),
             file_name=f"campaign_analysis_report_{report_id}_{timestamp.strftime('%Y%m%d_%H%M%S')}.csv",
             mime="text/csv",
-            key=f"download_report_{report_id}"
+            key=f"download_report_{report_id}",
+            on_click="ignore"
         )
         
         # Show summary statistics
         st.markdown("### 📊 Summary Statistics")
         
         # Calculate summary stats
-        target_regions = [r for r in analysis_df['Region'].tolist() if r != 'Control set']
-        control_regions = [r for r in analysis_df['Region'].tolist() if r == 'Control set']
+        num_control = int((analysis_df['Region'] == 'Control set').sum())
         
         summary_col1, summary_col2, summary_col3 = st.columns(3)
         
         with summary_col1:
-            st.metric("Target Regions", len(target_regions))
-            st.metric("Control Regions", len(control_regions))
+            st.metric("Target Regions", len(analysis_df) - num_control)
+            st.metric("Control Regions", num_control)
         
         with summary_col2:
             # Calculate average changes for Base Week 1 vs Campaign
-            base1_changes = []
-            for _, row in analysis_df.iterrows():
-                if row['Sessions_Total_Change1'] != 'N/A' and row['Sessions_Total_Change1'] != '∞':
-                    try:
-                        change_val = float(row['Sessions_Total_Change1'].replace('%', '').replace('+', ''))
-                        base1_changes.append(change_val)
-                    except:
-                        pass
-            
-            if base1_changes:
-                avg_change_base1 = sum(base1_changes) / len(base1_changes)
+            avg_change_base1 = average_percentage_change(analysis_df['Sessions_Total_Change1'])
+            if avg_change_base1 is not None:
                 st.metric("Avg Sessions Change (Base1)", f"{avg_change_base1:+.1f}%")
         
         with summary_col3:
             # Calculate average changes for Base Week 2 vs Campaign
-            base2_changes = []
-            for _, row in analysis_df.iterrows():
-                if row['Sessions_Total_Change2'] != 'N/A' and row['Sessions_Total_Change2'] != '∞':
-                    try:
-                        change_val = float(row['Sessions_Total_Change2'].replace('%', '').replace('+', ''))
-                        base2_changes.append(change_val)
-                    except:
-                        pass
-            
-            if base2_changes:
-                avg_change_base2 = sum(base2_changes) / len(base2_changes)
+            avg_change_base2 = average_percentage_change(analysis_df['Sessions_Total_Change2'])
+            if avg_change_base2 is not None:
                 st.metric("Avg Sessions Change (Base2)", f"{avg_change_base2:+.1f}%")
 
+CSV_HEADERS = [
+    "Region",
+    "Sessions (Total) - Base week",
+    "Sessions (Total) - Campaign", 
+    "Sessions (Total) - %change",
+    "Sessions (Google) - Base week",
+    "Sessions (Google) - Campaign",
+    "Sessions (Google) - %change", 
+    "Net Sales (Total) - Base week",
+    "Net Sales (Total) - Campaign",
+    "Net Sales (Total) - %change"
+]
+
+def format_csv_rows(cells, base):
+    """Format the quoted CSV data rows comparing base week `base` ('1' or '2') against the campaign"""
+    rows = format_comparison_cells(cells, base)
+    
+    # Join whole columns into quoted lines instead of formatting each row separately
+    lines = '"' + rows['region']
+    for col in rows.columns[1:]:
+        lines = lines + '","' + rows[col]
+    return (lines + '"').tolist()
+
 def create_csv_export_data(df, base1_label, base2_label, campaign_label):
     """Create CSV data that matches the exact display format"""
     
-    # Create the CSV content to match the HTML table format exactly
-    csv_lines = []
+    cells = format_report_cells(df)
+    
+    # Header line, quoted the same way as the data rows
+    header_line = '"' + '","'.join([''] + CSV_HEADERS + ['']) + '"'
     
     # First table: Base Week 1 vs Campaign
-    csv_lines.append(f"Base Week 1 ({base1_label}) vs Campaign ({campaign_label}) Comparison")
-    csv_lines.append("")
-    
-    # Headers for first table - matching HTML structure exactly
-    headers1 = [
-        "Region",
-        "Sessions (Total) - Base week",
-        "Sessions (Total) - Campaign", 
-        "Sessions (Total) - %change",
-        "Sessions (Google) - Base week",
-        "Sessions (Google) - Campaign",
-        "Sessions (Google) - %change", 
-        "Net Sales (Total) - Base week",
-        "Net Sales (Total) - Campaign",
-        "Net Sales (Total) - %change"
+    csv_lines = [
+        f"Base Week 1 ({base1_label}) vs Campaign ({campaign_label}) Comparison",
+        "",
+        header_line
     ]
-    csv_lines.append('","'.join([''] + headers1 + ['']))
-    csv_lines[-1] = '"' + csv_lines[-1] + '"'
-    
-    # Data rows for first table - properly escape values with commas
-    for _, row in df.iterrows():
-        data_row1 = [
-            f'"{row["Region"]}"',
-            f'"{row["Sessions_Total_Base1"]:,.0f}"',
-            f'"{row["Sessions_Total_Campaign"]:,.0f}"',
-            f'"{row["Sessions_Total_Change1"]}"',
-            f'"{row["Sessions_Google_Base1"]:,.0f}"',
-            f'"{row["Sessions_Google_Campaign"]:,.0f}"',
-            f'"{row["Sessions_Google_Change1"]}"',
-            f'"${row["Net_Sales_Base1"]:,.0f}"',
-            f'"${row["Net_Sales_Campaign"]:,.0f}"',
-            f'"{row["Net_Sales_Change1"]}"'
-        ]
-        csv_lines.append(','.join(data_row1))
-    
-    # Separator
-    csv_lines.append("")
-    csv_lines.append("")
-    
-    # Second table: Base Week 2 vs Campaign
-    csv_lines.append(f"Base Week 2 ({base2_label}) vs Campaign ({campaign_label}) Comparison")
-    csv_lines.append("")
-    
-    # Headers for second table
-    headers2 = [
-        "Region",
-        "Sessions (Total) - Base week",
-        "Sessions (Total) - Campaign", 
-        "Sessions (Total) - %change",
-        "Sessions (Google) - Base week",
-        "Sessions (Google) - Campaign",
-        "Sessions (Google) - %change", 
-        "Net Sales (Total) - Base week",
-        "Net Sales (Total) - Campaign",
-        "Net Sales (Total) - %change"
-    ]
-    csv_lines.append('","'.join([''] + headers2 + ['']))
-    csv_lines[-1] = '"' + csv_lines[-1] + '"'
-    
-    # Data rows for second table - properly escape values with commas
-    for _, row in df.iterrows():
-        data_row2 = [
-            f'"{row["Region"]}"',
-            f'"{row["Sessions_Total_Base2"]:,.0f}"',
-            f'"{row["Sessions_Total_Campaign"]:,.0f}"',
-            f'"{row["Sessions_Total_Change2"]}"',
-            f'"{row["Sessions_Google_Base2"]:,.0f}"',
-            f'"{row["Sessions_Google_Campaign"]:,.0f}"',
-            f'"{row["Sessions_Google_Change2"]}"',
-            f'"${row["Net_Sales_Base2"]:,.0f}"',
-            f'"${row["Net_Sales_Campaign"]:,.0f}"',
-            f'"{row["Net_Sales_Change2"]}"'
-        ]
-        csv_lines.append(','.join(data_row2))
+    csv_lines.extend(format_csv_rows(cells, '1'))
+    
+    # Separator, then second table: Base Week 2 vs Campaign
+    csv_lines.extend([
+        "",
+        "",
+        f"Base Week 2 ({base2_label}) vs Campaign ({campaign_label}) Comparison",
+        "",
+        header_line
+    ])
+    csv_lines.extend(format_csv_rows(cells, '2'))
     
     return "\n".join(csv_lines)
 
+@st.cache_data(show_spinner=False, max_entries=32)
+def create_csv_export_bytes(df, base1_label, base2_label, campaign_label):
+    """Encode a report's CSV export once so repeat downloads reuse the bytes"""
+    return create_csv_export_data(df, base1_label, base2_label, campaign_label).encode('utf-8')
+
 def main():
     # Header
     st.markdown('<h1 class="main-header">🚀 Campaign Analysis: DuckDB Optimized</h1>', unsafe_allow_html=True)
     
     # Initialize session state for storing multiple reports
-    if 'analysis_reports' not in st.session_state:
-        st.session_state.analysis_reports = []
-    if 'report_counter' not in st.session_state:
-        st.session_state.report_counter = 0
-    
-    # Initialize session state for storing multiple reports
-    if 'analysis_reports' not in st.session_state:
-        st.session_state.analysis_reports = []
-    if 'report_counter' not in st.session_state:
-        st.session_state.report_counter = 0
+    st.session_state.setdefault('analysis_reports', [])
+    st.session_state.setdefault('report_counter', 0)
     
     # Sidebar for file uploads
     st.sidebar.header("📁 Data Upload")
@@ -738,16 +945,26 @@ def main():
         """)
         return
     
-    # Load data with caching
+    # Warn about large Excel uploads, which parse far slower than CSV or Parquet
+    for uploaded_file in (ga_file, shopify_file):
+        if uploaded_file.name.endswith(('.xlsx', '.xls')) and uploaded_file.size > LARGE_EXCEL_BYTES:
+            st.warning(f"⚠️ {uploaded_file.name} is a large Excel file; converting it to Parquet or CSV will load much faster")
+    
+    # Load data with caching; the two uploads are independent, so parse them side by side
     with st.spinner("Loading and optimizing data..."):
-        ga_data = load_and_convert_data(ga_file, "ga")
-        shopify_data = load_and_convert_data(shopify_file, "shopify")
-        
-        if ga_data is None:
-            st.error("Error loading GA data")
+        ctx = get_script_run_ctx()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            ga_future = executor.submit(run_in_script_context, ctx, load_and_convert_data, ga_file, "ga")
+            shopify_future = executor.submit(run_in_script_context, ctx, load_and_convert_data, shopify_file, "shopify")
+        try:
+            ga_data = ga_future.result()
+        except Exception as e:
+            st.error(f"Error loading GA data: {str(e)}")
             return
-        if shopify_data is None:
-            st.error("Error loading Shopify data")
+        try:
+            shopify_data = shopify_future.result()
+        except Exception as e:
+            st.error(f"Error loading Shopify data: {str(e)}")
             return
     
     st.success(f"✅ Data loaded and optimized!")
@@ -760,87 +977,98 @@ def main():
     # Column selection
     st.sidebar.subheader("📊 Column Configuration")
     
-    ga_columns = list(ga_data.columns)
+    ga_columns = tuple(ga_data.columns)
     region_column = st.sidebar.selectbox(
         "Select Region Column from GA Data",
         options=ga_columns,
-        index=next((i for i, col in enumerate(ga_columns) if 'region' in col.lower()), 0),
+        index=default_region_column_index(ga_columns),
         help="Select the column that contains region information"
     )
     
-    shopify_columns = list(shopify_data.columns)
+    shopify_columns = tuple(shopify_data.columns)
     shopify_region_column = st.sidebar.selectbox(
         "Select Region Column from Shopify Data",
         options=shopify_columns,
-        index=next((i for i, col in enumerate(shopify_columns) if 'region' in col.lower()), 0),
+        index=default_region_column_index(shopify_columns),
         help="Select the column that contains region information in Shopify data"
     )
     
-    # Session source configuration
-    st.sidebar.subheader("🔍 Session Source Configuration")
-    
-    all_sources = sorted(list(ga_data['Session source'].unique())) if 'Session source' in ga_data.columns else []
-    
-    google_sources = st.sidebar.multiselect(
-        "Select Google Session Sources",
-        options=all_sources,
-        default=[source for source in all_sources if 'google' in source.lower()],
-        help="Select which session sources should be counted as Google sessions"
-    )
-    
-    # Base week calculation method
-    st.sidebar.subheader("📊 Calculation Method")
-    base_week_method = st.sidebar.radio(
-        "Campaign Period Calculation",
-        options=["Average (÷weeks)", "Sum (Total)"],
-        index=0,
-        help="Base weeks are ALWAYS averaged by number of weeks. Choose how to handle campaign period."
-    )
+    # Sources, regions and date range only change with the data, so compute them once
+    summary = ga_summary(ga_data, region_column)
     
-    st.sidebar.info("ℹ️ Base weeks are automatically averaged by their respective number of weeks (rounded to nearest whole number)")
+    if ga_data.empty:
+        st.error("No valid GA data found")
+        return
     
-    # Show week calculations
-    if not ga_data.empty:
-        st.sidebar.subheader("📊 Week Calculations")
+    min_date = summary['min_date']
+    max_date = summary['max_date']
+    
+    # Region search box. It stays outside the form below so the region options can follow it
+    available_regions = summary['regions']
+    
+    # Region picks are kept per region column, so switching columns starts from that
+    # column's default regions instead of a selection whose values no longer exist
+    selected_regions_key = f"selected_regions_{region_column}"
+    control_regions_key = f"control_regions_{region_column}"
+    
+    # Very long option lists make the multiselects slow, so narrow them with a search box
+    # (regions that are already selected always stay available)
+    region_options = available_regions
+    if len(available_regions) > MAX_REGION_OPTIONS:
+        st.sidebar.subheader("🌍 Region Search")
+        region_filter = st.sidebar.text_input(
+            "Filter Regions",
+            key="region_filter",
+            help=f"Type part of a region name; at most {MAX_REGION_OPTIONS:,} matching regions are listed"
+        ).strip().lower()
+        already_selected = set(st.session_state.get(selected_regions_key, [])) | set(st.session_state.get(control_regions_key, []))
+        matching = [r for r in available_regions if region_filter in str(r).lower()][:MAX_REGION_OPTIONS]
+        shown = set(matching) | already_selected
+        region_options = [r for r in available_regions if r in shown]
+    
+    # All analysis settings are batched in a form, so editing dates, labels, sources or
+    # regions doesn't rerun the app; they are validated and applied on Generate.
+    # Keyed widgets keep their values in session state across reruns
+    with st.sidebar.form("analysis_config", border=False):
+        # Session source configuration
+        st.subheader("🔍 Session Source Configuration")
         
-        # Calculate and display weeks for each period
-        base1_weeks = calculate_weeks_in_period(base_week1_start, base_week1_end) if 'base_week1_start' in locals() else 0
-        base2_weeks = calculate_weeks_in_period(base_week2_start, base_week2_end) if 'base_week2_start' in locals() else 0
-        campaign_weeks_calc = calculate_weeks_in_period(campaign_start, campaign_end) if 'campaign_start' in locals() else 0
+        all_sources = summary['sources']
         
-        if base1_weeks > 0:
-            base1_days = (pd.to_datetime(base_week1_end) - pd.to_datetime(base_week1_start)).days + 1
-            st.sidebar.write(f"**Base Week 1:** {base1_days} days → {base1_weeks} weeks (averaged)")
+        google_sources = st.multiselect(
+            "Select Google Session Sources",
+            options=all_sources,
+            default=[source for source in all_sources if 'google' in source.lower()],
+            help="Select which session sources should be counted as Google sessions",
+            key="google_sources"
+        )
         
-        if base2_weeks > 0:
-            base2_days = (pd.to_datetime(base_week2_end) - pd.to_datetime(base_week2_start)).days + 1
-            st.sidebar.write(f"**Base Week 2:** {base2_days} days → {base2_weeks} weeks (averaged)")
+        # Base week calculation method
+        st.subheader("📊 Calculation Method")
+        base_week_method = st.radio(
+            "Campaign Period Calculation",
+            options=["Average (÷weeks)", "Sum (Total)"],
+            index=0,
+            help="Base weeks are ALWAYS averaged by number of weeks. Choose how to handle campaign period.",
+            key="base_week_method"
+        )
         
-        if campaign_weeks_calc > 0:
-            campaign_days = (pd.to_datetime(campaign_end) - pd.to_datetime(campaign_start)).days + 1
-            campaign_method = "averaged" if base_week_method == "Average (÷weeks)" else "total"
-            st.sidebar.write(f"**Campaign:** {campaign_days} days → {campaign_weeks_calc} weeks ({campaign_method})")
-    
-    # Period configuration
-    st.sidebar.subheader("📅 Period Configuration")
-    
-    # Get date range from GA data
-    if not ga_data.empty:
-        min_date = ga_data['Date'].min().date()
-        max_date = ga_data['Date'].max().date()
+        st.info("ℹ️ Base weeks are automatically averaged by their respective number of weeks (rounded to nearest whole number)")
         
-        st.sidebar.write(f"**Available Date Range:** {min_date} to {max_date}")
+        # Period configuration
+        st.subheader("📅 Period Configuration")
+        st.write(f"**Available Date Range:** {min_date} to {max_date}")
         
         # Base Week 1
-        st.sidebar.write("**Base Week 1:**")
-        base_week1_start = st.sidebar.date_input(
+        st.write("**Base Week 1:**")
+        base_week1_start = st.date_input(
             "Base Week 1 Start", 
             value=min_date, 
             min_value=min_date, 
             max_value=max_date,
             key="base1_start"
         )
-        base_week1_end = st.sidebar.date_input(
+        base_week1_end = st.date_input(
             "Base Week 1 End", 
             value=min_date + timedelta(days=20), 
             min_value=min_date, 
@@ -849,15 +1077,15 @@ def main():
         )
         
         # Base Week 2
-        st.sidebar.write("**Base Week 2:**")
-        base_week2_start = st.sidebar.date_input(
+        st.write("**Base Week 2:**")
+        base_week2_start = st.date_input(
             "Base Week 2 Start", 
             value=min_date + timedelta(days=365), 
             min_value=min_date, 
             max_value=max_date,
             key="base2_start"
         )
-        base_week2_end = st.sidebar.date_input(
+        base_week2_end = st.date_input(
             "Base Week 2 End", 
             value=min_date + timedelta(days=385), 
             min_value=min_date, 
@@ -866,15 +1094,15 @@ def main():
         )
         
         # Campaign Period
-        st.sidebar.write("**Campaign Period:**")
-        campaign_start = st.sidebar.date_input(
+        st.write("**Campaign Period:**")
+        campaign_start = st.date_input(
             "Campaign Start", 
             value=min_date + timedelta(days=21), 
             min_value=min_date, 
             max_value=max_date,
             key="campaign_start"
         )
-        campaign_end = st.sidebar.date_input(
+        campaign_end = st.date_input(
             "Campaign End", 
             value=min_date + timedelta(days=27), 
             min_value=min_date, 
@@ -882,59 +1110,67 @@ def main():
             key="campaign_end"
         )
         
-        # Validation
-        if base_week1_start > base_week1_end:
-            st.sidebar.error("Base week 1 start date must be before end date")
-            return
-        if base_week2_start > base_week2_end:
-            st.sidebar.error("Base week 2 start date must be before end date")
-            return
-        if campaign_start > campaign_end:
-            st.sidebar.error("Campaign start date must be before end date")
-            return
-    else:
-        st.error("No valid GA data found")
-        return
-    
-    # Labels
-    st.sidebar.subheader("🏷️ Period Labels")
-    base1_label = st.sidebar.text_input("Base Week 1 Label", value="Base week 25")
-    base2_label = st.sidebar.text_input("Base Week 2 Label", value="Base week 26")
-    campaign_label = st.sidebar.text_input("Campaign Label", value="Campaign - Week 1")
+        # Labels
+        st.subheader("🏷️ Period Labels")
+        base1_label = st.text_input("Base Week 1 Label", value="Base week 25", key="base1_label")
+        base2_label = st.text_input("Base Week 2 Label", value="Base week 26", key="base2_label")
+        campaign_label = st.text_input("Campaign Label", value="Campaign - Week 1", key="campaign_label")
+        
+        # Region selection
+        st.subheader("🌍 Region Configuration")
+        st.write(f"**Available Regions from '{region_column}' ({len(available_regions)}):**")
+        st.write(summary['regions_label'])
+        
+        selected_regions = st.multiselect(
+            "Select Target Regions",
+            options=region_options,
+            default=[r for r in available_regions[:3] if r in region_options],
+            help="Select regions to include in the analysis",
+            key=selected_regions_key
+        )
+        
+        control_regions = st.multiselect(
+            "Select Control Regions",
+            options=region_options,
+            help="Select which regions should be labeled as 'Control set'",
+            key=control_regions_key
+        )
+        
+        generate_analysis = st.form_submit_button("🚀 Generate Analysis", type="primary")
     
-    # Region selection
-    st.sidebar.subheader("🌍 Region Configuration")
+    # Validate the submitted settings
+    if base_week1_start > base_week1_end:
+        st.sidebar.error("Base week 1 start date must be before end date")
+        return
+    if base_week2_start > base_week2_end:
+        st.sidebar.error("Base week 2 start date must be before end date")
+        return
+    if campaign_start > campaign_end:
+        st.sidebar.error("Campaign start date must be before end date")
+        return
     
-    available_regions = sorted(list(ga_data[region_column].unique())) if region_column in ga_data.columns else []
+    # Show week calculations (date_input returns dates, so days are plain date subtraction)
+    st.sidebar.subheader("📊 Week Calculations")
     
-    st.sidebar.write(f"**Available Regions from '{region_column}' ({len(available_regions)}):**")
-    if len(available_regions) <= 10:
-        st.sidebar.write(", ".join(available_regions))
-    else:
-        st.sidebar.write(f"{', '.join(available_regions[:10])}... and {len(available_regions)-10} more")
+    base1_days = (base_week1_end - base_week1_start).days + 1
+    st.sidebar.write(f"**Base Week 1:** {base1_days} days → {calculate_weeks_in_period(base_week1_start, base_week1_end)} weeks (averaged)")
     
-    selected_regions = st.sidebar.multiselect(
-        "Select Target Regions",
-        options=available_regions,
-        default=available_regions[:3] if len(available_regions) >= 3 else available_regions,
-        help="Select regions to include in the analysis"
-    )
+    base2_days = (base_week2_end - base_week2_start).days + 1
+    st.sidebar.write(f"**Base Week 2:** {base2_days} days → {calculate_weeks_in_period(base_week2_start, base_week2_end)} weeks (averaged)")
     
-    control_regions = st.sidebar.multiselect(
-        "Select Control Regions",
-        options=available_regions,
-        help="Select which regions should be labeled as 'Control set'"
-    )
+    campaign_days = (campaign_end - campaign_start).days + 1
+    campaign_method = "averaged" if base_week_method == "Average (÷weeks)" else "total"
+    st.sidebar.write(f"**Campaign:** {campaign_days} days → {calculate_weeks_in_period(campaign_start, campaign_end)} weeks ({campaign_method})")
     
     if not selected_regions:
         st.warning("Please select at least one region for analysis.")
         return
     # Generate analysis
-    if st.sidebar.button("🚀 Generate Analysis", type="primary"):
+    if generate_analysis:
         with st.spinner("Generating high-speed analysis with DuckDB..."):
             try:
                 # Create analysis using DuckDB
-                results, base1_divisor, base2_divisor, campaign_divisor, conn = create_analysis_with_duckdb(
+                results, base1_divisor, base2_divisor, campaign_divisor, prefix_sums = create_analysis_with_duckdb(
                     ga_data, shopify_data, selected_regions,
                     base_week1_start, base_week1_end, base_week2_start, base_week2_end,
                     campaign_start, campaign_end, control_regions, google_sources, 
@@ -944,19 +1180,15 @@ def main():
                 # Process control regions if any
                 if control_regions:
                     control_result = process_control_regions_duckdb(
-                        conn, control_regions, google_sources,
+                        prefix_sums, control_regions,
                         base_week1_start, base_week1_end, base_week2_start, base_week2_end,
-                        campaign_start, campaign_end, region_column, shopify_region_column,
+                        campaign_start, campaign_end,
                         base1_divisor, base2_divisor, campaign_divisor
                     )
-                    if control_result:
-                        results.append(control_result)
-                
-                # Close DuckDB connection
-                conn.close()
+                    if control_result is not None:
+                        results = pd.concat([results, control_result], ignore_index=True)
                 
-                # Convert to DataFrame
-                analysis_df = pd.DataFrame(results)
+                analysis_df = results
                 
                 # Increment report counter and store the report
                 st.session_state.report_counter += 1
@@ -994,7 +1226,6 @@ def main():
                 st.error(f"Error generating analysis: {str(e)}")
                 st.write("Please check your data format and configuration.")
                 # Show detailed error for debugging
-                import traceback
                 st.code(traceback.format_exc())
     
     # Add button to generate another analysis
@@ -1015,20 +1246,22 @@ def main():
     else:
         st.info("No analysis reports generated yet. Configure your analysis parameters and click 'Generate Analysis' to create your first report.")
     
-    # Data preview
-    with st.expander("👀 Data Preview"):
-        tab1, tab2 = st.tabs(["GA Data", "Shopify Data"])
-        
-        with tab1:
-            if not ga_data.empty:
-                st.write(f"**Date Range:** {ga_data['Date'].min()} to {ga_data['Date'].max()}")
-                st.write(f"**Memory Usage:** {ga_data.memory_usage(deep=True).sum() / 1024**2:.1f} MB")
-                st.dataframe(ga_data.head(10), use_container_width=True)
-        
-        with tab2:
-            if not shopify_data.empty:
-                st.write(f"**Memory Usage:** {shopify_data.memory_usage(deep=True).sum() / 1024**2:.1f} MB")
-                st.dataframe(shopify_data.head(10), use_container_width=True)
+    # Data preview, only built while the expander is open
+    data_preview = st.expander("👀 Data Preview", key="data_preview", on_change="rerun")
+    if data_preview.open:
+        with data_preview:
+            tab1, tab2 = st.tabs(["GA Data", "Shopify Data"])
+            
+            with tab1:
+                if not ga_data.empty:
+                    st.write(f"**Date Range:** {summary['min_date']} to {summary['max_date']}")
+                    st.write(f"**Memory Usage:** {memory_usage_mb(ga_data):.1f} MB")
+                    st.dataframe(ga_data.head(10), use_container_width=True)
+            
+            with tab2:
+                if not shopify_data.empty:
+                    st.write(f"**Memory Usage:** {memory_usage_mb(shopify_data):.1f} MB")
+                    st.dataframe(shopify_data.head(10), use_container_width=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,12 +1,24 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import io
 import duckdb
+import pyarrow as pa
 import tempfile
 import os
 
+# python-calamine reads Excel files far faster than openpyxl; use it when installed
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = None
+
 # Page configuration
 st.set_page_config(
     page_title="Campaign Analysis - Multi-Week Campaign",
@@ -14,8 +26,8 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Custom CSS
-st.markdown("""
+# Custom CSS, built once at import and injected at the top of every run
+CUSTOM_CSS = """
 <style>
 .main-header {
     font-size: 2.5rem;
@@ -47,32 +59,68 @@ st.markdown("""
     border: 1px solid #b0d4f1;
 }
 </style>
-""", unsafe_allow_html=True)
+"""
 
-@st.cache_data
+@st.cache_data(show_spinner=False, max_entries=4)
 def load_and_convert_data(uploaded_file, file_type="ga"):
-    """Load data and convert to parquet for faster processing"""
-    try:
-        # Load data
-        if uploaded_file.name.endswith('.csv'):
+    """Load and preprocess an uploaded file, raising if it can't be read
+    
+    The preprocessed frame is cached in memory only, so uploaded data is never written to disk.
+    """
+    # Load data
+    if uploaded_file.name.endswith('.csv'):
+        try:
+            # Multi-threaded Arrow CSV reader
+            df = pd.read_csv(uploaded_file, engine='pyarrow')
+        except (pa.ArrowInvalid, ValueError):
+            # Fall back to the C parser for files the Arrow reader rejects
+            uploaded_file.seek(0)
             df = pd.read_csv(uploaded_file)
-        else:
-            df = pd.read_excel(uploaded_file)
-        
-        # Preprocess based on file type
-        if file_type == "ga":
-            df = preprocess_ga_data(df)
-        else:
-            df = preprocess_shopify_data(df)
-        
+    elif uploaded_file.name.endswith('.parquet'):
+        df = pd.read_parquet(uploaded_file)
+    else:
+        df = pd.read_excel(uploaded_file, engine=EXCEL_ENGINE)
+    
+    # Preprocess based on file type
+    if file_type == "ga":
+        return preprocess_ga_data(df)
+    else:
+        return preprocess_shopify_data(df)
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def to_arrow_table(df):
+    """Convert preprocessed data to an Arrow table once so DuckDB can scan it zero-copy"""
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed-type object columns can't be converted; DuckDB can still scan pandas directly
         return df
-    except Exception as e:
-        return None, str(e)
+    
+    # Store date columns as DATE so period filters compare directly with the date parameters
+    for col in ['Date', 'Day']:
+        if col in table.column_names:
+            idx = table.column_names.index(col)
+            table = table.set_column(idx, col, table.column(col).cast(pa.date32(), safe=False))
+    
+    return table
 
-def preprocess_ga_data(df):
-    """Preprocess GA data"""
-    df = df.copy()
+def categorize_columns(df, columns=()):
+    """Store region, source and other repetitive text columns as categories
     
+    Categories are dictionary-encoded in DuckDB, so equality and IN filters compare small
+    integer codes. Text columns are converted when at most half their values are distinct.
+    """
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            continue
+        if col in columns or 'region' in col.lower():
+            df[col] = df[col].astype('category')
+        elif pd.api.types.is_string_dtype(df[col]) and df[col].nunique() <= len(df) // 2:
+            df[col] = df[col].astype('category')
+    return df
+
+def preprocess_ga_data(df):
+    """Preprocess GA data (modifies the freshly loaded frame in place)"""
     # Parse date column
     df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
     
@@ -92,12 +140,10 @@ def preprocess_ga_data(df):
         if col in df.columns:
             df[col] = df[col].astype(str).str.strip()
     
-    return df
+    return categorize_columns(df, text_columns)
 
 def preprocess_shopify_data(df):
-    """Preprocess Shopify data"""
-    df = df.copy()
-    
+    """Preprocess Shopify data (modifies the freshly loaded frame in place)"""
     # Parse date column
     df['Day'] = pd.to_datetime(df['Day'], errors='coerce')
     
@@ -111,377 +157,325 @@ def preprocess_shopify_data(df):
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
     
-    return df
+    return categorize_columns(df)
 
+@st.cache_data(show_spinner=False, max_entries=4)
+def date_bounds(df, date_column='Date'):
+    """First and last date in a preprocessed data set"""
+    return df[date_column].min().date(), df[date_column].max().date()
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def sorted_column_values(df, column):
+    """Sorted distinct non-empty values of a column, as stripped strings"""
+    # Handle mixed data types and NaN values; categorical columns only scan their codes
+    unique_values = df[column].dropna().unique()
+    
+    # Convert all values to strings and filter out empty ones
+    string_values = {str(value).strip() for value in unique_values}
+    return sorted(value for value in string_values if value and value.lower() != 'nan')
+
+@lru_cache(maxsize=256)
 def calculate_weeks_in_period(start_date, end_date):
     """Calculate number of weeks in a period, rounded to nearest whole number"""
-    start = pd.to_datetime(start_date)
-    end = pd.to_datetime(end_date)
-    days = (end - start).days + 1
+    days = (end_date - start_date).days + 1
     weeks = days / 7
     # Round to nearest whole number of weeks (minimum 1)
     return max(1, round(weeks))
 
-def calculate_percentage_change(base_value, campaign_value):
-    """Calculate percentage change between base and campaign values"""
-    if base_value == 0:
-        return "N/A" if campaign_value == 0 else "∞"
+def calculate_percentage_changes(base_values, campaign_values):
+    """Calculate percentage changes element-wise between arrays of base and campaign values
     
-    change = ((campaign_value - base_value) / base_value) * 100
-    return f"{change:+.1f}%"
+    A zero base gives NaN when the campaign value is also zero and infinity otherwise.
+    """
+    base_values = np.asarray(base_values, dtype=np.float64)
+    campaign_values = np.asarray(campaign_values, dtype=np.float64)
+    
+    # Zero bases have no meaningful change, so only the others are divided
+    changes = np.where(campaign_values == 0, np.nan, np.inf)
+    valid = base_values != 0
+    base, campaign = base_values[valid], campaign_values[valid]
+    changes[valid] = ((campaign - base) / base) * 100
+    return changes
 
-def create_analysis_with_duckdb(ga_data, shopify_data, regions, 
-                               base_week_start, base_week_end,
-                               campaign_weeks, control_regions, google_sources, 
-                               base_week_method, campaign_display_method, campaign_calculation_method, 
-                               region_column, shopify_region_column):
-    """Create analysis using DuckDB for faster processing with multiple campaign weeks"""
-    
-    # Initialize DuckDB connection
-    conn = duckdb.connect()
-    
+@st.cache_resource(show_spinner=False)
+def get_duckdb_database():
+    """Open the in-memory DuckDB database shared by all sessions of the app"""
+    return duckdb.connect()
+
+def quote_identifier(name):
+    """Quote a column name for use as a SQL identifier, escaping embedded quotes"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+def column_identifier(df, column):
+    """Quoted SQL identifier for a column of df; names that are not columns of df are rejected"""
+    if column not in df.columns:
+        raise ValueError(f"Column '{column}' not found in the data")
+    return quote_identifier(column)
+
+# Daily totals per region, aggregated once per upload and region column. The region
+# column is formatted in as a quoted identifier; the Google sources are bound as a list.
+# Sums are cast to DOUBLE because integer SUMs are HUGEINT, which Arrow hands over as decimals
+GA_DAILY_TOTALS_SQL = """
+SELECT 
+    CAST({region_column} AS VARCHAR) AS region,
+    Date,
+    CAST(SUM(Sessions) AS DOUBLE) AS total_sessions,
+    CAST(SUM(CASE WHEN list_contains($google_sources::VARCHAR[], "Session source") THEN Sessions ELSE 0 END) AS DOUBLE) AS google_sessions
+FROM ga_data
+GROUP BY 1, 2
+"""
+
+SHOPIFY_DAILY_TOTALS_SQL = """
+SELECT 
+    CAST({region_column} AS VARCHAR) AS region,
+    Day AS Date,
+    CAST(SUM("Net sales") AS DOUBLE) AS net_sales
+FROM shopify_data
+GROUP BY 1, 2
+"""
+
+# Per-period totals over a daily totals table. {period_columns} expands to one SUM per
+# value column and period, with the period's dates bound as $start_<i> and $end_<i>;
+# days outside all periods ($first_day to $last_day) are dropped before aggregating
+PERIOD_TOTALS_SQL = """
+SELECT region, {period_columns}
+FROM daily_totals
+WHERE Date BETWEEN $first_day AND $last_day
+AND region IN (SELECT UNNEST($regions::VARCHAR[]))
+GROUP BY region
+"""
+
+PERIOD_COLUMN_SQL = """
+    SUM(CASE WHEN Date BETWEEN $start_{i} AND $end_{i} THEN {column} ELSE 0 END) AS {column}_{i}"""
+
+def query_daily_totals(table_name, data, query, params=None):
+    """Aggregate uploaded data (registered as `table_name`) into daily per-region totals, as an Arrow table"""
+    conn = get_duckdb_database().cursor()
     try:
-        # Register dataframes with DuckDB
-        conn.register('ga_data', ga_data)
-        conn.register('shopify_data', shopify_data)
-        
-        # Calculate weeks for averaging (always rounded to nearest whole number)
-        base_week_weeks = calculate_weeks_in_period(base_week_start, base_week_end)
-        
-        # Base weeks are ALWAYS averaged (divided by number of weeks)
-        base_divisor = base_week_weeks  # Always divide base week by its weeks
-        
-        # Create Google sources filter
-        google_sources_str = "', '".join(google_sources)
-        google_filter = f'"Session source" IN (\'{google_sources_str}\')' if google_sources else "1=0"
-        
-        results = []
-        
-        # Process target regions
-        target_regions = [r for r in regions if r not in control_regions]
-        
-        for region in target_regions:
-            # GA Base Week query
-            ga_base_query = f"""
-            SELECT 
-                SUM(Sessions) as total_sessions,
-                SUM(CASE WHEN {google_filter} THEN Sessions ELSE 0 END) as google_sessions
-            FROM ga_data 
-            WHERE "{region_column}" = '{region}' 
-            AND Date >= '{base_week_start}' 
-            AND Date <= '{base_week_end}'
-            """
-            
-            # Shopify Base Week query
-            shopify_base_query = f"""
-            SELECT SUM("Net sales") as net_sales
-            FROM shopify_data 
-            WHERE "{shopify_region_column}" = '{region}' 
-            AND Day >= '{base_week_start}' 
-            AND Day <= '{base_week_end}'
-            """
-            
-            # Execute base week queries
-            ga_base_result = conn.execute(ga_base_query).fetchone()
-            shopify_base_result = conn.execute(shopify_base_query).fetchone()
-            
-            # Calculate base week metrics (always averaged)
-            sessions_total_base = (ga_base_result[0] or 0) / base_divisor
-            sessions_google_base = (ga_base_result[1] or 0) / base_divisor
-            net_sales_base = (shopify_base_result[0] or 0) / base_divisor
-            
-            # Initialize result row
-            result_row = {
-                'Region': region,
-                'Sessions_Total_Base': sessions_total_base,
-                'Sessions_Google_Base': sessions_google_base,
-                'Net_Sales_Base': net_sales_base
-            }
-            
-            # Process campaign weeks
-            campaign_sessions_total = []
-            campaign_sessions_google = []
-            campaign_net_sales = []
-            
-            for i, week in enumerate(campaign_weeks):
-                week_start = week['start']
-                week_end = week['end']
-                week_label = week['label']
-                
-                # Calculate divisor for this campaign week
-                campaign_week_weeks = calculate_weeks_in_period(week_start, week_end)
-                campaign_divisor = campaign_week_weeks if campaign_calculation_method == "Average (÷weeks)" else 1
-                
-                # GA Campaign query for this week
-                ga_campaign_query = f"""
-                SELECT 
-                    SUM(Sessions) as total_sessions,
-                    SUM(CASE WHEN {google_filter} THEN Sessions ELSE 0 END) as google_sessions
-                FROM ga_data 
-                WHERE "{region_column}" = '{region}' 
-                AND Date >= '{week_start}' 
-                AND Date <= '{week_end}'
-                """
-                
-                # Shopify Campaign query for this week
-                shopify_campaign_query = f"""
-                SELECT SUM("Net sales") as net_sales
-                FROM shopify_data 
-                WHERE "{shopify_region_column}" = '{region}' 
-                AND Day >= '{week_start}' 
-                AND Day <= '{week_end}'
-                """
-                
-                # Execute campaign queries
-                ga_campaign_result = conn.execute(ga_campaign_query).fetchone()
-                shopify_campaign_result = conn.execute(shopify_campaign_query).fetchone()
-                
-                # Calculate campaign metrics
-                sessions_total_campaign = (ga_campaign_result[0] or 0) / campaign_divisor
-                sessions_google_campaign = (ga_campaign_result[1] or 0) / campaign_divisor
-                net_sales_campaign = (shopify_campaign_result[0] or 0) / campaign_divisor
-                
-                # Store individual week data
-                campaign_sessions_total.append(sessions_total_campaign)
-                campaign_sessions_google.append(sessions_google_campaign)
-                campaign_net_sales.append(net_sales_campaign)
-                
-                if campaign_display_method == "Separate Columns":
-                    # Add individual week columns
-                    result_row[f'Sessions_Total_Campaign_Week_{i+1}'] = sessions_total_campaign
-                    result_row[f'Sessions_Google_Campaign_Week_{i+1}'] = sessions_google_campaign
-                    result_row[f'Net_Sales_Campaign_Week_{i+1}'] = net_sales_campaign
-                    
-                    # Calculate percentage changes for individual weeks
-                    result_row[f'Sessions_Total_Change_Week_{i+1}'] = calculate_percentage_change(sessions_total_base, sessions_total_campaign)
-                    result_row[f'Sessions_Google_Change_Week_{i+1}'] = calculate_percentage_change(sessions_google_base, sessions_google_campaign)
-                    result_row[f'Net_Sales_Change_Week_{i+1}'] = calculate_percentage_change(net_sales_base, net_sales_campaign)
-            
-            # If combined display, calculate combined metrics
-            if campaign_display_method == "Combined Column":
-                if campaign_calculation_method == "Average (÷weeks)":
-                    combined_sessions_total = sum(campaign_sessions_total) / len(campaign_sessions_total)
-                    combined_sessions_google = sum(campaign_sessions_google) / len(campaign_sessions_google)
-                    combined_net_sales = sum(campaign_net_sales) / len(campaign_net_sales)
-                else:  # Sum
-                    combined_sessions_total = sum(campaign_sessions_total)
-                    combined_sessions_google = sum(campaign_sessions_google)
-                    combined_net_sales = sum(campaign_net_sales)
-                
-                result_row['Sessions_Total_Campaign_Combined'] = combined_sessions_total
-                result_row['Sessions_Google_Campaign_Combined'] = combined_sessions_google
-                result_row['Net_Sales_Campaign_Combined'] = combined_net_sales
-                
-                # Calculate percentage changes for combined
-                result_row['Sessions_Total_Change_Combined'] = calculate_percentage_change(sessions_total_base, combined_sessions_total)
-                result_row['Sessions_Google_Change_Combined'] = calculate_percentage_change(sessions_google_base, combined_sessions_google)
-                result_row['Net_Sales_Change_Combined'] = calculate_percentage_change(net_sales_base, combined_net_sales)
-            
-            results.append(result_row)
-        
-        return results, base_divisor, conn
-        
-    except Exception as e:
+        conn.register(table_name, to_arrow_table(data))
+        return conn.execute(query, params or {}).to_arrow_table()
+    finally:
         conn.close()
-        raise e
 
-def process_control_regions_duckdb(conn, control_regions, google_sources, 
-                                  base_week_start, base_week_end,
-                                  campaign_weeks, region_column, shopify_region_column,
-                                  base_divisor, campaign_display_method, campaign_calculation_method):
-    """Process control regions using DuckDB aggregation"""
-    
-    if not control_regions:
-        return None
-    
-    # Create control regions filter
-    control_regions_str = "', '".join(control_regions)
-    control_filter = f'"{region_column}" IN (\'{control_regions_str}\')'
-    shopify_control_filter = f'"{shopify_region_column}" IN (\'{control_regions_str}\')'
-    
-    # Create Google sources filter
-    google_sources_str = "', '".join(google_sources)
-    google_filter = f'"Session source" IN (\'{google_sources_str}\')' if google_sources else "1=0"
-    
-    # Calculate control region count
-    control_region_count = len(control_regions)
-    
-    # Aggregate GA data for control regions - base week
-    ga_control_base_query = f"""
-    SELECT 
-        SUM(CASE WHEN Date >= '{base_week_start}' AND Date <= '{base_week_end}' THEN Sessions ELSE 0 END) as sessions_base,
-        SUM(CASE WHEN Date >= '{base_week_start}' AND Date <= '{base_week_end}' AND {google_filter} THEN Sessions ELSE 0 END) as google_sessions_base
-    FROM ga_data 
-    WHERE {control_filter}
-    """
+@st.cache_data(show_spinner=False, max_entries=8)
+def build_ga_daily_totals(ga_data, region_column, google_sources):
+    """Daily total and Google sessions per region (cached, so later analyses skip the raw scan)"""
+    return query_daily_totals(
+        'ga_data', ga_data, GA_DAILY_TOTALS_SQL.format(region_column=column_identifier(ga_data, region_column)),
+        {'google_sources': list(google_sources)}
+    )
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def build_shopify_daily_totals(shopify_data, region_column):
+    """Daily net sales per region (cached, so later analyses skip the raw scan)"""
+    return query_daily_totals('shopify_data', shopify_data, SHOPIFY_DAILY_TOTALS_SQL.format(region_column=column_identifier(shopify_data, region_column)))
+
+def run_in_script_context(ctx, func, *args):
+    """Run func in a worker thread attached to the calling script's Streamlit context"""
+    add_script_run_ctx(threading.current_thread(), ctx)
+    return func(*args)
+
+def query_period_totals(conn, daily_totals, value_columns, periods, regions):
+    """Sum daily totals over each period, returning one row per requested region (zeros if no data)"""
+    period_columns = ",".join(
+        PERIOD_COLUMN_SQL.format(i=i, column=column)
+        for i in range(len(periods)) for column in value_columns
+    )
+    query = PERIOD_TOTALS_SQL.format(period_columns=period_columns)
+    
+    params = {'regions': regions}
+    params['first_day'] = min(start for start, _ in periods)
+    params['last_day'] = max(end for _, end in periods)
+    for i, (start, end) in enumerate(periods):
+        params[f'start_{i}'] = start
+        params[f'end_{i}'] = end
+    
+    conn.register('daily_totals', daily_totals)
+    totals = conn.execute(query, params).df().set_index('region')
+    return totals.reindex(regions).fillna(0)
+
+def build_analysis_results(labels, ga_totals, shopify_totals, region_count, base_divisor,
+                           campaign_weeks, campaign_display_method, campaign_calculation_method):
+    """Build the analysis rows for `labels` from per-period totals (period 0 is the base week)
     
-    # Aggregate Shopify data for control regions - base week
-    shopify_control_base_query = f"""
-    SELECT 
-        SUM(CASE WHEN Day >= '{base_week_start}' AND Day <= '{base_week_end}' THEN "Net sales" ELSE 0 END) as sales_base
-    FROM shopify_data 
-    WHERE {shopify_control_filter}
+    Each metric is computed for all rows at once; totals are divided by the number of
+    regions they cover and by the period's divisor.
     """
-    
-    # Execute base week queries
-    ga_control_base_result = conn.execute(ga_control_base_query).fetchone()
-    shopify_control_base_result = conn.execute(shopify_control_base_query).fetchone()
+    def period_values(i, divisor):
+        divisor = region_count * divisor
+        return {
+            'Sessions_Total': np.asarray(ga_totals[f'total_sessions_{i}'], dtype=np.float64) / divisor,
+            'Sessions_Google': np.asarray(ga_totals[f'google_sessions_{i}'], dtype=np.float64) / divisor,
+            'Net_Sales': np.asarray(shopify_totals[f'net_sales_{i}'], dtype=np.float64) / divisor
+        }
     
     # Calculate base week metrics (always averaged)
-    sessions_total_base = (ga_control_base_result[0] or 0) / (control_region_count * base_divisor)
-    sessions_google_base = (ga_control_base_result[1] or 0) / (control_region_count * base_divisor)
-    net_sales_base = (shopify_control_base_result[0] or 0) / (control_region_count * base_divisor)
-    
-    # Initialize result row
-    result_row = {
-        'Region': 'Control set',
-        'Sessions_Total_Base': sessions_total_base,
-        'Sessions_Google_Base': sessions_google_base,
-        'Net_Sales_Base': net_sales_base
-    }
-    
-    # Process campaign weeks for control regions
-    campaign_sessions_total = []
-    campaign_sessions_google = []
-    campaign_net_sales = []
+    base = period_values(0, base_divisor)
+    results = {'Region': list(labels)}
+    for metric, values in base.items():
+        results[f'{metric}_Base'] = values
     
+    # Process campaign weeks
+    campaign = []
     for i, week in enumerate(campaign_weeks):
-        week_start = week['start']
-        week_end = week['end']
-        
         # Calculate divisor for this campaign week
-        campaign_week_weeks = calculate_weeks_in_period(week_start, week_end)
+        campaign_week_weeks = calculate_weeks_in_period(week['start'], week['end'])
         campaign_divisor = campaign_week_weeks if campaign_calculation_method == "Average (÷weeks)" else 1
         
-        # GA Campaign query for this week
-        ga_campaign_query = f"""
-        SELECT 
-            SUM(CASE WHEN Date >= '{week_start}' AND Date <= '{week_end}' THEN Sessions ELSE 0 END) as sessions_campaign,
-            SUM(CASE WHEN Date >= '{week_start}' AND Date <= '{week_end}' AND {google_filter} THEN Sessions ELSE 0 END) as google_sessions_campaign
-        FROM ga_data 
-        WHERE {control_filter}
-        """
-        
-        # Shopify Campaign query for this week
-        shopify_campaign_query = f"""
-        SELECT SUM(CASE WHEN Day >= '{week_start}' AND Day <= '{week_end}' THEN "Net sales" ELSE 0 END) as sales_campaign
-        FROM shopify_data 
-        WHERE {shopify_control_filter}
-        """
-        
-        # Execute campaign queries
-        ga_campaign_result = conn.execute(ga_campaign_query).fetchone()
-        shopify_campaign_result = conn.execute(shopify_campaign_query).fetchone()
-        
-        # Calculate campaign metrics
-        sessions_total_campaign = (ga_campaign_result[0] or 0) / (control_region_count * campaign_divisor)
-        sessions_google_campaign = (ga_campaign_result[1] or 0) / (control_region_count * campaign_divisor)
-        net_sales_campaign = (shopify_campaign_result[0] or 0) / (control_region_count * campaign_divisor)
-        
-        # Store individual week data
-        campaign_sessions_total.append(sessions_total_campaign)
-        campaign_sessions_google.append(sessions_google_campaign)
-        campaign_net_sales.append(net_sales_campaign)
+        week_values = period_values(i + 1, campaign_divisor)
+        campaign.append(week_values)
         
         if campaign_display_method == "Separate Columns":
-            # Add individual week columns
-            result_row[f'Sessions_Total_Campaign_Week_{i+1}'] = sessions_total_campaign
-            result_row[f'Sessions_Google_Campaign_Week_{i+1}'] = sessions_google_campaign
-            result_row[f'Net_Sales_Campaign_Week_{i+1}'] = net_sales_campaign
-            
-            # Calculate percentage changes for individual weeks
-            result_row[f'Sessions_Total_Change_Week_{i+1}'] = calculate_percentage_change(sessions_total_base, sessions_total_campaign)
-            result_row[f'Sessions_Google_Change_Week_{i+1}'] = calculate_percentage_change(sessions_google_base, sessions_google_campaign)
-            result_row[f'Net_Sales_Change_Week_{i+1}'] = calculate_percentage_change(net_sales_base, net_sales_campaign)
+            # Add individual week columns, then their percentage changes
+            for metric, values in week_values.items():
+                results[f'{metric}_Campaign_Week_{i+1}'] = values
+            for metric, values in week_values.items():
+                results[f'{metric}_Change_Week_{i+1}'] = calculate_percentage_changes(base[metric], values)
     
     # If combined display, calculate combined metrics
     if campaign_display_method == "Combined Column":
-        if campaign_calculation_method == "Average (÷weeks)":
-            combined_sessions_total = sum(campaign_sessions_total) / len(campaign_sessions_total)
-            combined_sessions_google = sum(campaign_sessions_google) / len(campaign_sessions_google)
-            combined_net_sales = sum(campaign_net_sales) / len(campaign_net_sales)
-        else:  # Sum
-            combined_sessions_total = sum(campaign_sessions_total)
-            combined_sessions_google = sum(campaign_sessions_google)
-            combined_net_sales = sum(campaign_net_sales)
-        
-        result_row['Sessions_Total_Campaign_Combined'] = combined_sessions_total
-        result_row['Sessions_Google_Campaign_Combined'] = combined_sessions_google
-        result_row['Net_Sales_Campaign_Combined'] = combined_net_sales
+        combined = {}
+        for metric in base:
+            combined[metric] = sum(week_values[metric] for week_values in campaign)
+            if campaign_calculation_method == "Average (÷weeks)":
+                combined[metric] = combined[metric] / len(campaign)
+            results[f'{metric}_Campaign_Combined'] = combined[metric]
         
         # Calculate percentage changes for combined
-        result_row['Sessions_Total_Change_Combined'] = calculate_percentage_change(sessions_total_base, combined_sessions_total)
-        result_row['Sessions_Google_Change_Combined'] = calculate_percentage_change(sessions_google_base, combined_sessions_google)
-        result_row['Net_Sales_Change_Combined'] = calculate_percentage_change(net_sales_base, combined_net_sales)
+        for metric, values in combined.items():
+            results[f'{metric}_Change_Combined'] = calculate_percentage_changes(base[metric], values)
     
-    return result_row
+    return pd.DataFrame(results)
 
-def create_display_dataframes(analysis_df, base_label, campaign_weeks, campaign_display_method):
-    """Create formatted dataframes for display"""
+def create_analysis_with_duckdb(ga_data, shopify_data, regions, 
+                               base_week_start, base_week_end,
+                               campaign_weeks, control_regions, google_sources, 
+                               base_week_method, campaign_display_method, campaign_calculation_method, 
+                               region_column, shopify_region_column):
+    """Create analysis using DuckDB for faster processing with multiple campaign weeks
     
-    if campaign_display_method == "Separate Columns":
-        # Create Base Week vs Individual Campaign Weeks comparison
-        df = pd.DataFrame()
-        df['Region'] = analysis_df['Region']
-        df[f'Sessions Total - {base_label}'] = analysis_df['Sessions_Total_Base'].apply(lambda x: f"{x:,.0f}")
-        
-        # Add columns for each campaign week
-        for i in range(len(campaign_weeks)):
-            week_label = campaign_weeks[i]['label']
-            df[f'Sessions Total - {week_label}'] = analysis_df[f'Sessions_Total_Campaign_Week_{i+1}'].apply(lambda x: f"{x:,.0f}")
-            df[f'Sessions Total - %Change ({week_label})'] = analysis_df[f'Sessions_Total_Change_Week_{i+1}']
-        
-        # Add Google sessions columns
-        df[f'Sessions Google - {base_label}'] = analysis_df['Sessions_Google_Base'].apply(lambda x: f"{x:,.0f}")
-        for i in range(len(campaign_weeks)):
-            week_label = campaign_weeks[i]['label']
-            df[f'Sessions Google - {week_label}'] = analysis_df[f'Sessions_Google_Campaign_Week_{i+1}'].apply(lambda x: f"{x:,.0f}")
-            df[f'Sessions Google - %Change ({week_label})'] = analysis_df[f'Sessions_Google_Change_Week_{i+1}']
-        
-        # Add Net Sales columns
-        df[f'Net Sales - {base_label}'] = analysis_df['Net_Sales_Base'].apply(lambda x: f"${x:,.0f}")
-        for i in range(len(campaign_weeks)):
-            week_label = campaign_weeks[i]['label']
-            df[f'Net Sales - {week_label}'] = analysis_df[f'Net_Sales_Campaign_Week_{i+1}'].apply(lambda x: f"${x:,.0f}")
-            df[f'Net Sales - %Change ({week_label})'] = analysis_df[f'Net_Sales_Change_Week_{i+1}']
+    Returns the target region rows followed by a 'Control set' row when control regions are given.
+    """
+    
+    # Daily per-region totals only depend on the data, region columns and Google sources,
+    # so they are built once and reused by every analysis with new dates or regions. The GA
+    # and Shopify scans are independent, so they run side by side on their own cursors
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        ga_future = executor.submit(
+            run_in_script_context, ctx, build_ga_daily_totals,
+            ga_data, region_column, tuple(sorted(google_sources))
+        )
+        shopify_future = executor.submit(
+            run_in_script_context, ctx, build_shopify_daily_totals,
+            shopify_data, shopify_region_column
+        )
+        ga_daily_totals = ga_future.result()
+        shopify_daily_totals = shopify_future.result()
+    
+    # Open a cursor on the shared database; views registered on it are private to this analysis
+    conn = get_duckdb_database().cursor()
+    
+    try:
+        # Calculate weeks for averaging (always rounded to nearest whole number)
+        base_week_weeks = calculate_weeks_in_period(base_week_start, base_week_end)
         
-        return df
+        # Base weeks are ALWAYS averaged (divided by number of weeks)
+        base_divisor = base_week_weeks  # Always divide base week by its weeks
         
-    else:  # Combined Column
-        # Create Base Week vs Combined Campaign comparison
-        df = pd.DataFrame()
-        df['Region'] = analysis_df['Region']
-        df[f'Sessions Total - {base_label}'] = analysis_df['Sessions_Total_Base'].apply(lambda x: f"{x:,.0f}")
-        df[f'Sessions Total - Campaign Combined'] = analysis_df['Sessions_Total_Campaign_Combined'].apply(lambda x: f"{x:,.0f}")
-        df['Sessions Total - %Change'] = analysis_df['Sessions_Total_Change_Combined']
-        df[f'Sessions Google - {base_label}'] = analysis_df['Sessions_Google_Base'].apply(lambda x: f"{x:,.0f}")
-        df[f'Sessions Google - Campaign Combined'] = analysis_df['Sessions_Google_Campaign_Combined'].apply(lambda x: f"{x:,.0f}")
-        df['Sessions Google - %Change'] = analysis_df['Sessions_Google_Change_Combined']
-        df[f'Net Sales - {base_label}'] = analysis_df['Net_Sales_Base'].apply(lambda x: f"${x:,.0f}")
-        df[f'Net Sales - Campaign Combined'] = analysis_df['Net_Sales_Campaign_Combined'].apply(lambda x: f"${x:,.0f}")
-        df['Net Sales - %Change'] = analysis_df['Net_Sales_Change_Combined']
+        # Process target regions
+        target_regions = [r for r in regions if r not in control_regions]
         
-        return df
-
-def create_csv_export_data(df, base_label, campaign_weeks, campaign_display_method):
-    """Create CSV data that matches the exact display format"""
+        # Sum the target and control regions' daily totals over the base week and every campaign
+        # week in one grouped query per table (period 0 is the base week, period i+1 campaign week i)
+        query_regions = list(dict.fromkeys(target_regions + list(control_regions)))
+        periods = [(base_week_start, base_week_end)] + [(week['start'], week['end']) for week in campaign_weeks]
+        ga_totals = query_period_totals(
+            conn, ga_daily_totals, ['total_sessions', 'google_sessions'], periods, query_regions
+        )
+        shopify_totals = query_period_totals(
+            conn, shopify_daily_totals, ['net_sales'], periods, query_regions
+        )
+    finally:
+        conn.close()
     
-    # This is a simplified version - you can expand based on the display format
-    csv_lines = []
+    results = build_analysis_results(
+        target_regions, ga_totals.loc[target_regions], shopify_totals.loc[target_regions], 1, base_divisor,
+        campaign_weeks, campaign_display_method, campaign_calculation_method
+    )
     
-    if campaign_display_method == "Separate Columns":
-        csv_lines.append(f"Base Week ({base_label}) vs Individual Campaign Weeks Comparison")
-    else:
-        csv_lines.append(f"Base Week ({base_label}) vs Combined Campaign Comparison")
+    # Process control regions if any: the control set reports the average region, so its
+    # totals are summed over the control regions and divided by their count
+    if control_regions:
+        control_result = build_analysis_results(
+            ['Control set'],
+            ga_totals.loc[control_regions].sum().to_frame().T,
+            shopify_totals.loc[control_regions].sum().to_frame().T,
+            len(control_regions), base_divisor,
+            campaign_weeks, campaign_display_method, campaign_calculation_method
+        )
+        results = pd.concat([results, control_result], ignore_index=True)
     
-    csv_lines.append("")
+    return results
+
+def format_amounts(values, prefix=""):
+    """Format a column of amounts as whole numbers with thousands separators"""
+    # Map the bound str.format over plain Python floats instead of a per-row lambda apply
+    return pd.Series(list(map((prefix + "{:,.0f}").format, values.tolist())), index=values.index, dtype=object)
+
+def format_changes(values):
+    """Format a column of percentage changes, showing N/A and ∞ for changes from a zero base"""
+    labels = np.where(np.isnan(values), "N/A", "∞").astype(object)
+    finite = np.isfinite(values.to_numpy())
+    labels[finite] = np.char.mod("%+.1f%%", values.to_numpy()[finite])
+    return pd.Series(labels, index=values.index, dtype=object)
+
+# Report metrics: analysis column prefix, display name and amount prefix
+DISPLAY_METRICS = [
+    ('Sessions_Total', 'Sessions Total', ""),
+    ('Sessions_Google', 'Sessions Google', ""),
+    ('Net_Sales', 'Net Sales', "$")
+]
+
+def create_display_dataframes(analysis_df, base_label, campaign_weeks, campaign_display_method):
+    """Create formatted dataframes for display"""
+    
+    # Collect the formatted columns in display order, then build the frame in one go
+    columns = {'Region': analysis_df['Region']}
+    for metric, name, prefix in DISPLAY_METRICS:
+        columns[f'{name} - {base_label}'] = analysis_df[f'{metric}_Base'].pipe(format_amounts, prefix)
+        
+        if campaign_display_method == "Separate Columns":
+            # Base Week vs Individual Campaign Weeks, each followed by its change
+            for i, week in enumerate(campaign_weeks):
+                week_label = week['label']
+                columns[f'{name} - {week_label}'] = analysis_df[f'{metric}_Campaign_Week_{i+1}'].pipe(format_amounts, prefix)
+                columns[f'{name} - %Change ({week_label})'] = analysis_df[f'{metric}_Change_Week_{i+1}'].pipe(format_changes)
+        else:  # Combined Column
+            # Base Week vs Combined Campaign
+            columns[f'{name} - Campaign Combined'] = analysis_df[f'{metric}_Campaign_Combined'].pipe(format_amounts, prefix)
+            columns[f'{name} - %Change'] = analysis_df[f'{metric}_Change_Combined'].pipe(format_changes)
+    
+    return pd.DataFrame(columns)
+
+def create_csv_export_data(df, base_label, campaign_weeks, campaign_display_method):
+    """Create CSV data from the numeric analysis dataframe"""
+    
+    # Changes from a zero base are NaN or infinite; write them as the report shows them
+    export = df.copy(deep=False)
+    for col in export.columns:
+        if '_Change_' in col:
+            values = export[col].to_numpy(dtype=np.float64)
+            labels = values.astype(object)
+            labels[np.isnan(values)] = "N/A"
+            labels[np.isinf(values)] = "∞"
+            export[col] = labels
     
     # Convert dataframe to CSV format
     csv_buffer = io.StringIO()
-    df.to_csv(csv_buffer, index=False)
-    csv_content = csv_buffer.getvalue()
+    export.to_csv(csv_buffer, index=False)
     
-    return csv_content
+    return csv_buffer.getvalue()
 
 def render_campaign_weeks_input(section_id):
     """Render the campaign weeks input section"""
@@ -592,8 +586,7 @@ def render_analysis_section(ga_data, shopify_data, section_id):
     # Get date range from GA data for defaults
     if ga_data is not None and not ga_data.empty and 'Date' in ga_data.columns:
         try:
-            min_date = ga_data['Date'].min().date()
-            max_date = ga_data['Date'].max().date()
+            min_date, max_date = date_bounds(ga_data)
         except Exception as e:
             st.error(f"Error accessing Date column: {str(e)}")
             # Use fallback dates
@@ -643,15 +636,7 @@ def render_analysis_section(ga_data, shopify_data, section_id):
     all_sources = []
     if ga_data is not None and not ga_data.empty and 'Session source' in ga_data.columns:
         try:
-            # Handle mixed data types and NaN values
-            source_series = ga_data['Session source'].dropna()  # Remove NaN values
-            unique_sources = source_series.unique()
-            
-            # Convert all values to strings and filter out empty ones
-            string_sources = [str(source).strip() for source in unique_sources if str(source).strip() and str(source).lower() != 'nan']
-            
-            # Sort the cleaned sources
-            all_sources = sorted(string_sources)
+            all_sources = sorted_column_values(ga_data, 'Session source')
         except Exception as e:
             st.error(f"Error accessing Session source column: {str(e)}")
             all_sources = []
@@ -774,15 +759,7 @@ def render_analysis_section(ga_data, shopify_data, section_id):
     available_regions = []
     if ga_data is not None and not ga_data.empty and region_column and region_column in ga_data.columns:
         try:
-            # Handle mixed data types and NaN values
-            region_series = ga_data[region_column].dropna()  # Remove NaN values
-            unique_regions = region_series.unique()
-            
-            # Convert all values to strings and filter out empty ones
-            string_regions = [str(region).strip() for region in unique_regions if str(region).strip() and str(region).lower() != 'nan']
-            
-            # Sort the cleaned regions
-            available_regions = sorted(string_regions)
+            available_regions = sorted_column_values(ga_data, region_column)
         except Exception as e:
             st.error(f"Error accessing region column '{region_column}': {str(e)}")
             available_regions = []
@@ -878,7 +855,8 @@ def render_analysis_section(ga_data, shopify_data, section_id):
                 return
             
             try:
-                results, base_divisor, conn = create_analysis_with_duckdb(
+                # Target regions and the control set (if any) come from the same grouped queries
+                analysis_df = create_analysis_with_duckdb(
                     ga_data, shopify_data, selected_regions,
                     base_week_start, base_week_end,
                     campaign_weeks, control_regions, google_sources, 
@@ -886,23 +864,6 @@ def render_analysis_section(ga_data, shopify_data, section_id):
                     region_column, shopify_region_column
                 )
                 
-                # Process control regions if any
-                if control_regions:
-                    control_result = process_control_regions_duckdb(
-                        conn, control_regions, google_sources,
-                        base_week_start, base_week_end,
-                        campaign_weeks, region_column, shopify_region_column,
-                        base_divisor, campaign_display_method, campaign_calculation_method
-                    )
-                    if control_result:
-                        results.append(control_result)
-                
-                # Close DuckDB connection
-                conn.close()
-                
-                # Convert to DataFrame
-                analysis_df = pd.DataFrame(results)
-                
                 # Store the results in session state
                 st.session_state[f'section_{section_id}'] = {
                     'report_generated': True,
@@ -993,6 +954,9 @@ def render_analysis_section(ga_data, shopify_data, section_id):
         )
 
 def main():
+    # Streamlit drops elements a run doesn't emit, so the styles are sent on each run
+    st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
+    
     # Header
     st.markdown('<h1 class="main-header">📊 Campaign Analysis - Multi-Week Campaign</h1>', unsafe_allow_html=True)
     
@@ -1032,14 +996,15 @@ def main():
         
         # Load data with caching
         with st.spinner("Loading and optimizing data..."):
-            ga_data = load_and_convert_data(ga_file, "ga")
-            shopify_data = load_and_convert_data(shopify_file, "shopify")
-            
-            if ga_data is None:
-                st.error("Error loading GA data")
+            try:
+                ga_data = load_and_convert_data(ga_file, "ga")
+            except Exception as e:
+                st.error(f"Error loading GA data: {str(e)}")
                 return
-            if shopify_data is None:
-                st.error("Error loading Shopify data")
+            try:
+                shopify_data = load_and_convert_data(shopify_file, "shopify")
+            except Exception as e:
+                st.error(f"Error loading Shopify data: {str(e)}")
                 return
         
         st.sidebar.success("✅ Data loaded!")
@@ -1047,8 +1012,7 @@ def main():
         st.sidebar.write(f"**Shopify Data:** {len(shopify_data):,} rows")
         
         if not ga_data.empty:
-            min_date = ga_data['Date'].min().date()
-            max_date = ga_data['Date'].max().date()
+            min_date, max_date = date_bounds(ga_data)
             st.sidebar.write(f"**Date Range:** {min_date} to {max_date}")
     
     # Main content area
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import campaign_analysis_duckdb as app
+
+
+def cube_frame(cube, date_column):
+    """Daily cube as a frame sorted by region and day, for comparing aggregation paths"""
+    keep = cube['region_codes'] >= 0
+    frame = pd.DataFrame({
+        'region': cube['regions'][cube['region_codes'][keep]].astype(str),
+        'day': cube[date_column][keep].astype('datetime64[D]')
+    })
+    for col, values in cube.items():
+        if col not in ('region_codes', 'regions', date_column):
+            frame[col] = np.asarray(values, dtype=np.float64)[keep]
+    return frame.sort_values(['region', 'day']).reset_index(drop=True)
+
+
+@pytest.fixture
+def ga_data():
+    return app.preprocess_ga_data(pd.DataFrame({
+        'Region': ['North', 'North', 'North', 'South', 'South'],
+        'Date': ['2024-01-01 08:00', '2024-01-01 12:00', '2024-01-01 18:00',
+                 '2024-01-01 09:00', '2024-01-02 09:00'],
+        'Session source': ['google', 'direct', 'google', 'google', 'bing'],
+        'Sessions': [10, 20, 5, 7, 3]
+    }))
+
+
+@pytest.fixture
+def shopify_data():
+    return app.preprocess_shopify_data(pd.DataFrame({
+        'Shipping region': ['North', 'North', 'South'],
+        'Day': ['2024-01-01 08:00', '2024-01-01 18:00', '2024-01-02 10:00'],
+        'Net sales': [100.0, 50.5, 20.0]
+    }))
+
+
+def test_ga_cube_paths_agree_on_timestamped_rows(ga_data, monkeypatch):
+    pandas_cube = cube_frame(app.build_ga_cube(ga_data, 'Region', ['google']), 'Date')
+    monkeypatch.setattr(app, 'PANDAS_AGGREGATION_MAX_ROWS', 0)
+    duckdb_cube = cube_frame(app.build_ga_cube(ga_data, 'Region', ['google']), 'Date')
+    
+    pd.testing.assert_frame_equal(pandas_cube, duckdb_cube)
+    north = pandas_cube[pandas_cube['region'] == 'North']
+    assert north[['sessions', 'google_sessions']].values.tolist() == [[35.0, 15.0]]
+
+
+def test_shopify_cube_paths_agree_on_timestamped_rows(shopify_data, monkeypatch):
+    pandas_cube = cube_frame(app.build_shopify_cube(shopify_data, 'Shipping region'), 'Day')
+    monkeypatch.setattr(app, 'PANDAS_AGGREGATION_MAX_ROWS', 0)
+    duckdb_cube = cube_frame(app.build_shopify_cube(shopify_data, 'Shipping region'), 'Day')
+    
+    pd.testing.assert_frame_equal(pandas_cube, duckdb_cube)
+
+
+def test_prefix_sums_add_rows_on_the_same_day():
+    cube = {
+        'region_codes': np.array([0, 0, 0]),
+        'regions': np.array(['North'], dtype=object),
+        'Date': np.array(['2024-01-01T08:00', '2024-01-01T12:00', '2024-01-01T18:00'], dtype='datetime64[ns]'),
+        'sessions': np.array([10.0, 20.0, 5.0])
+    }
+    prefix_sums = app.build_prefix_sums(cube, 'Date', ('sessions',))
+    assert prefix_sums['cum']['sessions'].tolist() == [[0.0, 35.0]]
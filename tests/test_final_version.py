@@ -0,0 +1,140 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import campaign_analysis_final_version as app
+
+BASE_WEEK = (date(2024, 1, 1), date(2024, 1, 7))
+CAMPAIGN_WEEKS = [
+    {'label': 'W1', 'start': date(2024, 1, 8), 'end': date(2024, 1, 14)},
+    {'label': 'W2', 'start': date(2024, 1, 15), 'end': date(2024, 1, 28)}
+]
+TARGET_REGIONS = ['North', 'South', 'Nowhere']
+CONTROL_REGIONS = ['East', 'West']
+
+
+@pytest.fixture
+def ga_data():
+    return app.preprocess_ga_data(pd.DataFrame({
+        'Region': ['North', 'North', 'North', 'North', 'South', 'East', 'West', 'East', 'West'],
+        'Date': ['2024-01-01', '2024-01-03', '2024-01-09', '2024-01-20', '2024-01-10',
+                 '2024-01-02', '2024-01-05', '2024-01-08', '2024-01-12'],
+        'Session source': ['google', 'direct', 'google', 'direct', 'google',
+                           'google', 'direct', 'google', 'google'],
+        'Sessions': [10, 20, 30, 40, 5, 6, 14, 8, 2]
+    }))
+
+
+@pytest.fixture
+def shopify_data():
+    return app.preprocess_shopify_data(pd.DataFrame({
+        'Shipping region': ['North', 'North', 'East', 'West', 'East', 'West'],
+        'Day': ['2024-01-02', '2024-01-11', '2024-01-03', '2024-01-04', '2024-01-09', '2024-01-13'],
+        'Net sales': [100.0, 150.0, 40.0, 60.0, 30.0, 50.0]
+    }))
+
+
+def analyze(ga_data, shopify_data, display_method, calculation_method="Average (÷weeks)"):
+    return app.create_analysis_with_duckdb(
+        ga_data, shopify_data, TARGET_REGIONS, *BASE_WEEK, CAMPAIGN_WEEKS, CONTROL_REGIONS,
+        ['google'], "Average (÷weeks)", display_method, calculation_method, 'Region', 'Shipping region'
+    ).set_index('Region')
+
+
+def test_period_totals_match_hand_computed_sums(ga_data):
+    daily_totals = app.build_ga_daily_totals(ga_data, 'Region', ('google',))
+    periods = [BASE_WEEK] + [(week['start'], week['end']) for week in CAMPAIGN_WEEKS]
+    conn = app.get_duckdb_database().cursor()
+    try:
+        totals = app.query_period_totals(
+            conn, daily_totals, ['total_sessions', 'google_sessions'], periods, ['North', 'Nowhere']
+        )
+    finally:
+        conn.close()
+    
+    assert totals.loc['North', ['total_sessions_0', 'total_sessions_1', 'total_sessions_2']].tolist() == [30, 30, 40]
+    assert totals.loc['North', ['google_sessions_0', 'google_sessions_1', 'google_sessions_2']].tolist() == [10, 30, 0]
+    assert (totals.loc['Nowhere'] == 0).all()
+
+
+def test_separate_columns_average_weeks(ga_data, shopify_data):
+    results = analyze(ga_data, shopify_data, "Separate Columns")
+    
+    north = results.loc['North']
+    assert north[['Sessions_Total_Base', 'Sessions_Google_Base', 'Net_Sales_Base']].tolist() == [30, 10, 100]
+    assert north[['Sessions_Total_Campaign_Week_1', 'Sessions_Google_Campaign_Week_1', 'Net_Sales_Campaign_Week_1']].tolist() == [30, 30, 150]
+    # The second campaign week spans two weeks, so it is averaged over them
+    assert north[['Sessions_Total_Campaign_Week_2', 'Sessions_Google_Campaign_Week_2', 'Net_Sales_Campaign_Week_2']].tolist() == [20, 0, 0]
+    assert north[['Sessions_Total_Change_Week_1', 'Sessions_Google_Change_Week_1', 'Net_Sales_Change_Week_1']].tolist() == pytest.approx([0, 200, 50])
+
+
+def test_regions_without_base_values(ga_data, shopify_data):
+    results = analyze(ga_data, shopify_data, "Separate Columns")
+    
+    # A region with no rows sums to zero, and its changes are undefined
+    nowhere = results.loc['Nowhere']
+    assert (nowhere.filter(regex='_(Base|Campaign_Week_\\d)$') == 0).all()
+    assert np.isnan(nowhere.filter(like='_Change_').astype(float)).all()
+    
+    # South has sessions only in the campaign, and no sales at all
+    south = results.loc['South']
+    assert np.isinf(south['Sessions_Total_Change_Week_1'])
+    assert np.isnan(south['Net_Sales_Change_Week_1'])
+    
+    display = app.create_display_dataframes(results.reset_index(), "Base", CAMPAIGN_WEEKS, "Separate Columns").set_index('Region')
+    assert display.loc['South', 'Sessions Total - %Change (W1)'] == "∞"
+    assert display.loc['South', 'Net Sales - %Change (W1)'] == "N/A"
+    assert display.loc['Nowhere', 'Sessions Google - %Change (W2)'] == "N/A"
+
+
+def test_control_set_averages_control_regions(ga_data, shopify_data):
+    control = analyze(ga_data, shopify_data, "Separate Columns").loc['Control set']
+    
+    assert control[['Sessions_Total_Base', 'Sessions_Google_Base', 'Net_Sales_Base']].tolist() == [10, 3, 50]
+    assert control[['Sessions_Total_Campaign_Week_1', 'Sessions_Google_Campaign_Week_1', 'Net_Sales_Campaign_Week_1']].tolist() == [5, 5, 40]
+    assert control[['Sessions_Total_Change_Week_1', 'Sessions_Google_Change_Week_1', 'Net_Sales_Change_Week_1']].tolist() == pytest.approx([-50, 200 / 3, -20])
+
+
+def test_separate_columns_display(ga_data, shopify_data):
+    results = analyze(ga_data, shopify_data, "Separate Columns").reset_index()
+    display = app.create_display_dataframes(results, "Base", CAMPAIGN_WEEKS, "Separate Columns")
+    
+    assert display.columns.tolist() == ['Region'] + [
+        column
+        for name in ['Sessions Total', 'Sessions Google', 'Net Sales']
+        for column in [f'{name} - Base', f'{name} - W1', f'{name} - %Change (W1)',
+                       f'{name} - W2', f'{name} - %Change (W2)']
+    ]
+    assert display['Region'].tolist() == ['North', 'South', 'Nowhere', 'Control set']
+    north = display.set_index('Region').loc['North']
+    assert north[['Sessions Google - Base', 'Sessions Google - W1', 'Sessions Google - %Change (W1)']].tolist() == ['10', '30', '+200.0%']
+    assert north[['Net Sales - Base', 'Net Sales - W1', 'Net Sales - %Change (W1)']].tolist() == ['$100', '$150', '+50.0%']
+
+
+@pytest.mark.parametrize("calculation_method, combined_total, change", [
+    ("Average (÷weeks)", 25, "-16.7%"),
+    ("Sum (Total)", 70, "+133.3%")
+])
+def test_combined_column_display(ga_data, shopify_data, calculation_method, combined_total, change):
+    results = analyze(ga_data, shopify_data, "Combined Column", calculation_method)
+    assert results.loc['North', 'Sessions_Total_Campaign_Combined'] == combined_total
+    
+    display = app.create_display_dataframes(results.reset_index(), "Base", CAMPAIGN_WEEKS, "Combined Column")
+    assert display.columns.tolist() == ['Region'] + [
+        column
+        for name in ['Sessions Total', 'Sessions Google', 'Net Sales']
+        for column in [f'{name} - Base', f'{name} - Campaign Combined', f'{name} - %Change']
+    ]
+    north = display.set_index('Region').loc['North']
+    assert north[['Sessions Total - Base', 'Sessions Total - Campaign Combined', 'Sessions Total - %Change']].tolist() == ['30', str(combined_total), change]
+
+
+def test_column_identifier_rejects_unknown_columns(ga_data):
+    assert app.column_identifier(ga_data, 'Region') == '"Region"'
+    with pytest.raises(ValueError):
+        app.column_identifier(ga_data, 'City')
+    
+    quoted = ga_data.rename(columns={'Region': 'Region "A"'})
+    assert app.column_identifier(quoted, 'Region "A"') == '"Region ""A"""'